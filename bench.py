@@ -0,0 +1,539 @@
+"""Benchmarks for the hot paths, runs off-device. Usage: python bench.py [name ...]"""
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import geodesy
+
+
+def timed(fn, repeat=3):
+    """Best wall time of a few runs in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_points(n, seed=0):
+    # somewhere in southern ontario, where the stores are
+    rng = np.random.default_rng(seed)
+    return rng.uniform((41.7, -83.1), (46.5, -74.5), size=(n, 2))
+
+
+def simulated_track(seconds, speed_mps, hz=10, start=(43.6674, -79.3812), seed=0):
+    """(N, 2) lat/lon samples of someone wandering around at speed_mps, turning a little each second"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * hz)
+    course = np.cumsum(rng.normal(0, np.radians(20), n // hz + 1)).repeat(hz)[:n]
+    step_m = speed_mps / hz
+    dlat = np.cumsum(np.cos(course) * step_m) / geodesy.EARTH_RADIUS_M
+    dlon = np.cumsum(np.sin(course) * step_m) / (geodesy.EARTH_RADIUS_M * np.cos(np.radians(start[0])))
+    return np.column_stack((start[0] + np.degrees(dlat), start[1] + np.degrees(dlon)))
+
+
+def ensure_stores_index(index_path='stores.index'):
+    if not os.path.exists(index_path):
+        subprocess.run([sys.executable, 'tree.py', 'data/lcbo.csv', 'data/all.csv'], check=True)
+    return index_path
+
+
+# the old per-script math versions are the baseline
+scalar_haversine = geodesy._scalar_haversine
+scalar_bearing = geodesy._scalar_bearing
+
+
+def bench_geodesy():
+    print("geodesy: scalar math loop vs numpy kernels (haversine + bearing)")
+    print(f"{'points':>9} {'scalar':>12} {'numpy':>12} {'numpy out=':>12}")
+    for n in (1, 1000, 1000000):
+        a = random_points(n, seed=1)
+        b = random_points(n, seed=2)
+        lat1, lon1, lat2, lon2 = a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+        out = np.empty(n)
+        work = geodesy.workspace(n)
+
+        def scalar():
+            for i in range(n):
+                scalar_haversine(lat1[i], lon1[i], lat2[i], lon2[i])
+                scalar_bearing(lat1[i], lon1[i], lat2[i], lon2[i])
+
+        def vector():
+            geodesy.haversine(lat1, lon1, lat2, lon2)
+            geodesy.calculate_bearing(lat1, lon1, lat2, lon2)
+
+        def vector_out():
+            geodesy.haversine(lat1, lon1, lat2, lon2, out=out, work=work)
+            geodesy.calculate_bearing(lat1, lon1, lat2, lon2, out=out, work=work)
+
+        print(f"{n:>9} {timed(scalar, 1 if n > 1000 else 3) * 1e3:>10.3f}ms "
+              f"{timed(vector) * 1e3:>10.3f}ms {timed(vector_out) * 1e3:>10.3f}ms")
+
+        # make sure the kernels still agree with the old code
+        i = n - 1
+        assert abs(geodesy.haversine(lat1, lon1, lat2, lon2)[i] - scalar_haversine(lat1[i], lon1[i], lat2[i], lon2[i])) < 1e-6
+        assert abs(geodesy.calculate_bearing(lat1, lon1, lat2, lon2)[i] - scalar_bearing(lat1[i], lon1[i], lat2[i], lon2[i])) < 1e-9
+
+
+# run in a fresh interpreter so import time and peak memory aren't shared between loaders
+# (VmHWM rather than ru_maxrss, linux carries ru_maxrss over from the forking parent)
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+{load}
+elapsed = time.perf_counter() - start
+peak_kb = next(line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM'))
+print(elapsed, peak_kb)
+"""
+
+FIRST_QUERY = "; tree.query([[0.7621, -1.3855]], k=1)"
+LOADERS = {
+    'numpy only': "import numpy",
+    'balltree (joblib)': "import joblib; tree, stores = joblib.load('{joblib}')" + FIRST_QUERY,
+    'kdtree (index)': "from storeindex import load_stores; tree, stores = load_stores('{index}')" + FIRST_QUERY,
+    'brute (index)': "from storeindex import load_stores; tree, stores = load_stores('{index}', 'brute')" + FIRST_QUERY,
+}
+
+
+def ensure_index(joblib_path, index_path):
+    if not os.path.exists(index_path):
+        import joblib
+        from storeindex import write_store_index
+        write_store_index(index_path, joblib.load(joblib_path)[1], source=joblib_path)
+
+
+def bench_engines():
+    import joblib
+    from storeindex import load_stores
+
+    for joblib_path, index_path in (('tree.joblib', 'tree.index'), ('treeall.joblib', 'treeall.index')):
+        ensure_index(joblib_path, index_path)
+        print(f"engines: {joblib_path} vs {index_path}, cold start to first answer")
+        print(f"{'loader':>18} {'startup':>10} {'peak rss':>10}")
+        for name, load in LOADERS.items():
+            script = STARTUP_SCRIPT.format(load=load.format(joblib=joblib_path, index=index_path))
+            result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+            seconds, rss_kb = result.stdout.split()
+            print(f"{name:>18} {float(seconds) * 1e3:>8.1f}ms {int(rss_kb) / 1024:>8.1f}MB")
+
+        balltree, stores = joblib.load(joblib_path)
+        stores = np.asarray(stores)
+        points = np.radians(random_points(100000))
+        print(f"{'engine':>18} {'1 point':>10} {'100k points':>12}")
+        for name, tree in (('balltree', balltree), ('kdtree', load_stores(index_path)[0]),
+                           ('brute', load_stores(index_path, 'brute')[0])):
+            single = timed(lambda: [tree.query(points[i:i + 1]) for i in range(1000)]) / 1000
+            batch = timed(lambda: tree.query(points), 1)
+            print(f"{name:>18} {single * 1e6:>8.1f}us {batch * 1e3:>10.1f}ms")
+
+            # the whole point is that they give the same answers, ties between duplicate stores aside
+            dist, ind = tree.query(points[:20000], k=3)
+            ref_dist, ref_ind = balltree.query(points[:20000], k=3)
+            assert np.array_equal(dist, ref_dist)
+            assert np.array_equal(stores[ind], stores[ref_ind])
+        print()
+
+
+def bench_ranked():
+    from nearest import StoreIndex
+    from storeindex import load_stores
+
+    index_path = ensure_stores_index()
+    stores = StoreIndex(*load_stores(index_path))
+    points = random_points(100000)
+    queries = {
+        'nearest (k=1)': lambda p: stores.query(p),
+        'k_closest k=5': lambda p: stores.k_closest(p, 5),
+        'within 2 km': lambda p: stores.within_radius(p, 2000),
+        'within 10 km': lambda p: stores.within_radius(p, 10000),
+    }
+    print(f"ranked: {index_path}, k=1 vs k-nearest vs radius")
+    print(f"{'query':>16} {'1 point':>10} {'100k points':>12} {'stores/point':>13}")
+    for name, query in queries.items():
+        single = timed(lambda: [query(points[i]) for i in range(1000)]) / 1000
+        batch = timed(lambda: query(points), 1)
+        found = query(points[:10000])[1].size / 10000
+        print(f"{name:>16} {single * 1e6:>8.1f}us {batch * 1e3:>10.1f}ms {found:>13.1f}")
+
+
+def bench_cache():
+    from nearest import NearestCache, StoreIndex
+    from storeindex import load_stores
+
+    stores = StoreIndex(*load_stores(ensure_stores_index()))
+    print("cache: 10 Hz find_closest_store over 30 minutes of movement")
+    print(f"{'speed':>10} {'hit rate':>9} {'misses':>7} {'grid':>6} {'tree':>6} {'uncached':>10} {'cached':>10}")
+    for label, speed in (('walking', 1.4), ('cycling', 5.0), ('driving', 15.0)):
+        track = simulated_track(30 * 60, speed)
+        cache = NearestCache(stores)
+        start = time.perf_counter()
+        cached = [cache.lookup(lat, lon, 'lcbo')[0] for lat, lon in track]
+        cached_s = time.perf_counter() - start
+        start = time.perf_counter()
+        uncached = [stores.query((lat, lon), 'lcbo')[0][0] for lat, lon in track]
+        uncached_s = time.perf_counter() - start
+        assert cached == uncached  # the cache must never change the answer
+        stats = cache.stats()
+        print(f"{label:>10} {stats['hit_rate']:>8.1%} {stats['misses']:>7} {stats['grid_hits']:>6} {stats['tree_queries']:>6} "
+              f"{uncached_s / len(track) * 1e6:>8.1f}us {cached_s / len(track) * 1e6:>8.1f}us")
+
+
+# a log recorded off the receiver (cat /dev/ttyAMA0 > data/track.nmea), simulated if there isn't one
+NMEA_LOG = 'data/track.nmea'
+
+
+def nmea_corpus(seconds=3600):
+    """Lines of NMEA like a NEO-6M sends them, one burst of sentences a second"""
+    import nmea
+    if os.path.exists(NMEA_LOG):
+        with open(NMEA_LOG, 'rb') as f:
+            return [line for line in f if line.strip()]
+    track = simulated_track(seconds, 5.0, hz=1)
+    lines = []
+    for t, (lat, lon) in enumerate(track):
+        talker = b'GN' if t % 2 else b'GP'  # newer receivers say GN
+        lines.append(nmea.rmc_sentence(lat, lon, 5.0, (t * 7) % 360, 43200 + t, talker))
+        lines.append(nmea.sentence(b'GPVTG,,T,,M,9.720,N,18.001,K,A'))
+        lines.append(nmea.gga_sentence(lat, lon, 1, 8, 1.1, 43200 + t, talker))
+        lines.append(nmea.sentence(b'GPGSA,A,3,10,07,05,02,29,04,08,13,,,,,1.72,1.03,1.38'))
+        lines.append(nmea.sentence(b'GPGSV,3,1,11,10,63,137,17,07,61,098,15,05,59,290,20,08,54,157,30'))
+        lines.append(nmea.sentence(b'GPGLL,4340.0200,N,07922.8000,W,120000.00,A,A'))
+    return lines
+
+
+def bench_nmea():
+    import nmea
+
+    lines = nmea_corpus()
+    print(f"nmea: {len(lines)} lines from {NMEA_LOG if os.path.exists(NMEA_LOG) else 'a simulated receiver'}")
+    parsers = {'nmea.parse': lambda: [nmea.parse(line) for line in lines],
+               'nmea.parse (memoryview)': lambda: [nmea.parse(memoryview(line)) for line in lines]}
+    try:
+        import pynmea2
+    except ImportError:
+        print("(pynmea2 not installed, only timing nmea.parse)")
+    else:
+        def old():
+            # what get_gps_coords did with the lines it kept, on every line
+            for line in lines:
+                try:
+                    msg = pynmea2.parse(line.decode('ascii'))
+                except pynmea2.ParseError:
+                    continue
+                if hasattr(msg, 'latitude') and hasattr(msg, 'longitude'):
+                    msg.latitude, msg.longitude
+        parsers['pynmea2'] = old
+
+        # and the same positions come out
+        for line in lines:
+            ours = nmea.parse(line)
+            if ours is not None and ours.valid:
+                msg = pynmea2.parse(line.decode('ascii'))
+                assert abs(ours.lat - msg.latitude) < 1e-9 and abs(ours.lon - msg.longitude) < 1e-9
+    print(f"{'parser':>24} {'per line':>10} {'lines/s':>10}")
+    for name, parse in parsers.items():
+        seconds = timed(parse)
+        print(f"{name:>24} {seconds / len(lines) * 1e6:>8.2f}us {len(lines) / seconds:>10.0f}")
+
+
+# a trace recorded off the chip (python magnetometer.py 600 data/compass.csv), simulated if there isn't one
+MAG_LOG = 'data/compass.csv'
+
+
+def mag_trace(seconds=600, hz=15, seed=0):
+    """(t, x, y, z) samples and the true heading in degrees (None for a recording): someone mostly
+    standing still, turning now and then, right through north too"""
+    from magnetometer import read_trace
+    if os.path.exists(MAG_LOG):
+        return np.array(read_trace(MAG_LOG)), None
+    rng = np.random.default_rng(seed)
+    n = seconds * hz
+    turning = rng.random(n // hz + 1).repeat(hz)[:n] < 0.2
+    rate = np.where(turning, rng.normal(0, 60, n // hz + 1).repeat(hz)[:n], 0.0)  # deg/s
+    true = (350 + np.cumsum(rate) / hz) % 360
+    field = 220  # horizontal counts at gain 1.3, about 0.2 gauss
+    x = field * np.cos(np.radians(true)) + rng.normal(0, 4, n)
+    y = field * np.sin(np.radians(true)) + rng.normal(0, 4, n)
+    z = -400 + rng.normal(0, 4, n)
+    return np.column_stack((np.arange(n) / hz, np.rint(x), np.rint(y), np.rint(z))), true
+
+
+def bench_heading():
+    from headingfilter import make_filter
+    from sprites import ANGLES
+
+    trace, true = mag_trace()
+    hz = round((len(trace) - 1) / (trace[-1, 0] - trace[0, 0]))
+    raw = (np.degrees(np.arctan2(trace[:, 2], trace[:, 1])) % 360).tolist()
+    print(f"heading: {len(raw)} samples at {hz} Hz from {MAG_LOG if true is None else 'a simulated chip'}")
+
+    def wrapped(d):
+        return (np.asarray(d) + 180) % 360 - 180
+
+    def report(name, out, per_sample_s):
+        out = np.asarray(out)
+        jitter = np.abs(wrapped(np.diff(out)))
+        arrow = np.round(out * ANGLES / 360) % ANGLES
+        changes = np.count_nonzero(np.diff(arrow)) / (len(out) / hz)
+        error = f"{np.sqrt(np.mean(wrapped(out - true) ** 2)):>8.2f}" if true is not None else f"{'-':>8}"
+        print(f"{name:>16} {per_sample_s * 1e6:>8.2f}us {np.median(jitter):>8.3f} {error} {changes:>10.2f}")
+        return np.median(jitter)
+
+    print(f"{'filter':>16} {'per sample':>10} {'jitter':>8} {'rms err':>8} {'arrow/s':>10}")
+    raw_jitter = report('raw', raw, 0.0)
+    for kind in ('mean', 'smooth'):
+        for latency_s in (0.1, 0.2, 0.5):
+            f = make_filter(kind, latency_s, hz)
+            seconds = timed(lambda: [f.update(h) for h in raw], repeat=1)
+            f = make_filter(kind, latency_s, hz)
+            out = [f.update(h) for h in raw]
+            jitter = report(f"{kind} {latency_s}s", out, seconds / len(raw))
+            # replay check: smoother than the raw heading, and never further behind than the fastest turn
+            # over the filter's delay (plus noise), a wrap around north going wrong would be ~180 off
+            assert jitter < raw_jitter, f"{kind} {latency_s}s doesn't smooth anything"
+            if true is not None:
+                worst = np.abs(wrapped(np.diff(true))).max() * hz * f.latency(hz) * 2 + 10
+                assert np.abs(wrapped(np.asarray(out) - true)).max() < worst, f"{kind} {latency_s}s lost track"
+
+
+def bench_predict():
+    from deadreckoning import Predictor
+    from gps import GPSReader
+    import nmea
+
+    # 1 Hz fixes of a 5 m/s walk with the receiver's few meters of noise, drawn at 10 Hz
+    seconds, fps, speed = 600, 10, 5.0
+    true = simulated_track(seconds, speed, hz=fps)
+    rng = np.random.default_rng(1)
+    noise_deg = rng.normal(0, 3.0, (seconds, 2)) / geodesy.EARTH_RADIUS_M * 180 / np.pi
+    fixes = true[::fps] + noise_deg
+    course = geodesy.calculate_bearing(true[:-fps:fps, 0], true[:-fps:fps, 1], true[fps::fps, 0], true[fps::fps, 1])
+    course = np.append(course, course[-1])
+
+    # RMC then GGA ~120 ms later, like a 9600 baud port sends them, is still one update per fix
+    predictor = Predictor()
+    gps = GPSReader(predictor=predictor)
+    for s in range(10):
+        gps.feed(nmea.rmc_sentence(*fixes[s], speed, course[s], 43200 + s), now=s)
+        gps.feed(nmea.gga_sentence(*fixes[s], utc_s=43200 + s), now=s + 0.12)
+    assert predictor.updates == 10, predictor.updates
+
+    print(f"predict: {seconds} 1 Hz fixes at {speed} m/s, position asked for {fps} times a second")
+    print(f"{'position':>12} {'mean err':>10} {'p95 err':>10} {'max jump':>10} {'per frame':>10}")
+    for name, predictor in (('last fix', None), ('predicted', Predictor())):
+        gps = GPSReader(predictor=predictor)
+        positions = []
+        start = time.perf_counter()
+        for i in range(seconds * fps):
+            if i % fps == 0:
+                s = i // fps
+                gps.feed(nmea.rmc_sentence(*fixes[s], speed, course[s], 43200 + s), now=i / fps)
+            positions.append(gps.position(now=i / fps))
+        per_frame = (time.perf_counter() - start) / (seconds * fps)
+        positions = np.array(positions)
+        error = geodesy.haversine(positions[:, 0], positions[:, 1], true[:, 0], true[:, 1])
+        jump = geodesy.haversine(positions[1:, 0], positions[1:, 1], positions[:-1, 0], positions[:-1, 1])
+        print(f"{name:>12} {error.mean():>8.2f}m {np.percentile(error, 95):>8.2f}m {jump.max():>8.2f}m "
+              f"{per_frame * 1e6:>8.2f}us")
+
+
+def compass_frames(seconds=60, fps=10, seed=0):
+    """(heading, bearing, distance) per frame: someone walking towards a store, the heading wobbling a bit"""
+    rng = np.random.default_rng(seed)
+    n = seconds * fps
+    heading = 90 + np.cumsum(rng.normal(0, 0.5, n))
+    bearing = np.full(n, 135.0)
+    distance = np.linspace(400, 400 - 1.4 * seconds, n)
+    return list(zip(heading, bearing, distance))
+
+
+def pil_compass(heading_deg, bearing_deg, distance_m):
+    """The frame lcbovis_nopygame.draw_compass draws"""
+    import math
+    from PIL import Image, ImageDraw, ImageFont
+    image = Image.new("1", (128, 64))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((96 - 25, 32 - 25, 96 + 25, 32 + 25), outline=1, width=1)
+    turn_rad = math.radians((bearing_deg - heading_deg) % 360)
+    draw.line((96, 32, 96 + math.sin(turn_rad) * 25, 32 - math.cos(turn_rad) * 25), fill=1, width=2)
+    draw.text((5, 24), f"{int(distance_m)}m", font=ImageFont.load_default(), fill=1)
+    return image
+
+
+def bench_oled():
+    from oled import FULL_FRAME_BYTES, PartialDisplay
+
+    print("oled: bytes over I2C per frame, 60 s of walking at 10 fps")
+    frames = [pil_compass(*frame) for frame in compass_frames()]
+    writes = []
+    display = PartialDisplay(None, write=writes.append)
+    diff_s = timed(lambda: [PartialDisplay(None, write=len).show_image(image) for image in frames], 1) / len(frames)
+    for image in frames:
+        display.show_image(image)
+    stats = display.stats()
+    # 400 kHz, 9 bits per byte on the wire
+    print(f"{'':>10} {'bytes/frame':>12} {'bus time':>10} {'skipped':>8}")
+    print(f"{'full':>10} {FULL_FRAME_BYTES:>12} {FULL_FRAME_BYTES * 9 / 400:>8.2f}ms {0:>8}")
+    print(f"{'partial':>10} {stats['bytes_per_frame']:>12.1f} {stats['bytes_per_frame'] * 9 / 400:>8.2f}ms "
+          f"{stats['skipped']:>8}")
+    print(f"diffing costs {diff_s * 1e6:.1f}us a frame, {len(writes) / len(frames):.1f} writes a frame")
+
+    # replaying the writes onto a blank screen has to give the last frame
+    from oled import image_to_pages
+    screen = np.zeros((8, 128), dtype=np.uint8)
+    for cmd, data in zip(writes[::2], writes[1::2]):
+        _, _, col0, col1, _, page0, page1 = cmd
+        screen[page0:page1 + 1, col0:col1 + 1] = np.frombuffer(data[1:], dtype=np.uint8).reshape(page1 - page0 + 1, -1)
+    assert np.array_equal(screen, image_to_pages(frames[-1]))
+
+
+def pygame_compass(surface, font, heading_deg, bearing_deg, distance_m):
+    """What lcbovisual.draw_compass draws, onto a 128x64 surface"""
+    import math
+    import pygame
+    surface.fill((0, 0, 0))
+    pygame.draw.circle(surface, (255, 255, 255), (96, 32), 25, 1)
+    turn_rad = math.radians((bearing_deg - heading_deg) % 360)
+    pygame.draw.line(surface, (255, 255, 255), (96, 32), (96 + math.sin(turn_rad) * 25, 32 - math.cos(turn_rad) * 25), 2)
+    surface.blit(font.render(f"{int(distance_m)}m", True, (255, 255, 255)), (5, 24))
+
+
+def bench_render():
+    from oled import image_to_pages
+    from framebuf import FrameBuffer
+    from sprites import SurfaceAtlas, draw_direct, numpy_atlas, pil_atlas, pygame_atlas
+
+    frames = compass_frames()
+    print(f"render: time per frame over {len(frames)} frames, drawing everything vs composing from the atlas")
+    print(f"{'back-end':>10} {'drawn':>10} {'atlas':>10} {'atlas build':>12}")
+
+    start = time.perf_counter()
+    atlas = pil_atlas()
+    build_s = time.perf_counter() - start
+    out = np.empty_like(atlas.dial)
+    drawn = timed(lambda: [image_to_pages(pil_compass(*f)) for f in frames]) / len(frames)
+    composed = timed(lambda: [atlas.compose(*f, out=out) for f in frames]) / len(frames)
+    print(f"{'PIL':>10} {drawn * 1e6:>8.1f}us {composed * 1e6:>8.1f}us {build_s * 1e3:>10.1f}ms")
+
+    # framebuf.py, straight into the screen's page layout, nothing to convert afterwards
+    start = time.perf_counter()
+    atlas = numpy_atlas()
+    build_s = time.perf_counter() - start
+    fb = FrameBuffer()
+    drawn = timed(lambda: [draw_direct(fb, *f) for f in frames]) / len(frames)
+    composed = timed(lambda: [atlas.compose(*f, out=fb.pages) for f in frames]) / len(frames)
+    print(f"{'numpy':>10} {drawn * 1e6:>8.1f}us {composed * 1e6:>8.1f}us {build_s * 1e3:>10.1f}ms")
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import pygame
+    except ImportError:
+        print("(pygame not installed)")
+        return
+    pygame.init()
+    font = pygame.font.SysFont(None, 24)
+    surface = pygame.Surface((128, 64))
+    start = time.perf_counter()
+    atlas = pygame_atlas(font)
+    build_s = time.perf_counter() - start
+    atlas = SurfaceAtlas(atlas)
+    drawn = timed(lambda: [pygame_compass(surface, font, *f) for f in frames]) / len(frames)
+    composed = timed(lambda: [atlas.compose(surface, *f) for f in frames]) / len(frames)
+    print(f"{'pygame':>10} {drawn * 1e6:>8.1f}us {composed * 1e6:>8.1f}us {build_s * 1e3:>10.1f}ms")
+    pygame.quit()
+
+
+def bench_hdmi():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import pygame
+    except ImportError:
+        print("hdmi: pygame not installed")
+        return
+    from offscreen import ScaledDisplay
+    from sprites import SurfaceAtlas, pygame_atlas
+
+    frames = compass_frames()
+    print(f"hdmi: pygame front-end frame cost, {len(frames)} frames, as fast as they go")
+    print(f"{'screen':>10} {'renderer':>22} {'fps':>8} {'cpu/frame':>10}")
+    pygame.init()
+    font = pygame.font.SysFont(None, 24)
+    for size in ((1920, 1080), (800, 480)):
+        screen = pygame.display.set_mode(size)
+
+        def full():
+            # what the front-ends did: fill and flip the whole native screen every frame
+            for f in frames:
+                screen.fill((0, 0, 0))
+                pygame_compass(screen, font, *f)
+                pygame.display.flip()
+
+        display = ScaledDisplay(screen)
+        atlas = SurfaceAtlas(pygame_atlas(font)).convert()
+
+        def scaled():
+            for f in frames:
+                atlas.compose(display.surface, *f)
+                display.present()
+
+        for name, run in (('native fill + flip', full), (f'128x64 x{display.scale} dirty rects', scaled)):
+            cpu = time.process_time()
+            wall = timed(run, 1)
+            cpu = time.process_time() - cpu
+            print(f"{'%dx%d' % size:>10} {name:>22} {len(frames) / wall:>8.0f} {cpu / len(frames) * 1e3:>8.2f}ms")
+    pygame.quit()
+
+
+def _nothing(a, b):
+    return a
+
+
+def bench_instrument():
+    from instrument import Instruments
+
+    n, repeats = 100000, 21
+    disabled = Instruments(False, flush_s=0)
+    enabled = Instruments(True, flush_s=0)
+    calls = {'plain': _nothing, 'disabled': disabled.wrap('nothing', _nothing),
+             'enabled': enabled.wrap('nothing', _nothing),
+             'count': enabled.count, 'count off': disabled.count}
+    print(f"instrument: cost of a timed span around a no-op, {repeats} interleaved runs of {n} calls")
+    ns = {name: [] for name in calls}
+    for _ in range(repeats):
+        # one run of each in turn, so they all see the same machine
+        for name, fn in calls.items():
+            start = time.perf_counter_ns()
+            for _ in range(n):
+                fn('calls', 1)
+            ns[name].append((time.perf_counter_ns() - start) / n)
+    plain = np.array(ns['plain'])
+    print(f"{'':>10} {'min':>8} {'median':>8}   over a plain call")
+    for name in ('disabled', 'enabled', 'count', 'count off'):
+        extra = np.array(ns[name]) - plain
+        print(f"{name:>10} {extra.min():>6.0f}ns {np.median(extra):>6.0f}ns")
+    print(f"{'':>10} {enabled.snapshot()['spans']['nothing']}")
+
+
+BENCHMARKS = {
+    'geodesy': bench_geodesy,
+    'engines': bench_engines,
+    'ranked': bench_ranked,
+    'cache': bench_cache,
+    'nmea': bench_nmea,
+    'heading': bench_heading,
+    'predict': bench_predict,
+    'instrument': bench_instrument,
+    'oled': bench_oled,
+    'render': bench_render,
+    'hdmi': bench_hdmi,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
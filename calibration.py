@@ -0,0 +1,162 @@
+"""Hard and soft iron calibration for the HMC5883L.
+
+Anything magnetic in the enclosure adds a fixed offset to every reading (hard iron) and squashes the
+field differently along different axes (soft iron), so turning the device around traces an off
+center ellipsoid instead of a sphere around 0 and atan2(y, x) is off by up to tens of degrees.
+Calibrating means fitting that ellipsoid to samples taken while the device is turned every which
+way, then undoing it: corrected = matrix @ (raw - offset) lies on a sphere again.
+
+    python calibration.py [seconds] [compass_cal.json]    -> turn the device around while it runs
+    python calibration.py --trace data/compass.csv         -> fit a trace magnetometer.py saved
+
+If the device only got turned flat (z hardly changes) there's no ellipsoid to fit, so it fits the
+x/y ellipse instead and leaves z alone. At runtime Calibration.apply is a subtraction and a 3x3
+multiply with the numbers already unpacked into floats.
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+CALIBRATION_FILE = 'compass_cal.json'
+MIN_SAMPLES = 50
+FLAT_RATIO = 0.2  # z spread below this much of the x/y spread means it was only turned flat
+
+
+def fit_ellipsoid(samples):
+    """(offset (3,), matrix (3, 3)) from (N, 3) raw samples on the surface of an ellipsoid.
+    Least squares of a x^2 + b y^2 + c z^2 + 2d xy + 2e xz + 2f yz + 2g x + 2h y + 2i z = 1."""
+    samples = np.asarray(samples, dtype=np.float64)
+    scale = np.abs(samples).max()  # keeps the squares from swamping the linear terms
+    x, y, z = (samples / scale).T
+    design = np.column_stack((x * x, y * y, z * z, 2 * x * y, 2 * x * z, 2 * y * z, 2 * x, 2 * y, 2 * z))
+    a, b, c, d, e, f, g, h, i = np.linalg.lstsq(design, np.ones(len(x)), rcond=None)[0]
+    quadric = np.array([[a, d, e], [d, b, f], [e, f, c]])
+    center = -np.linalg.solve(quadric, [g, h, i])
+    # (p - center)^T Q (p - center) = 1 + center^T Q center, so sqrt(Q / that) maps it to the unit sphere
+    quadric /= 1 + center @ quadric @ center
+    return center * scale, _sphere_matrix(quadric) / scale
+
+
+def fit_ellipse(samples):
+    """Same thing for the x/y plane only: (offset (2,), matrix (2, 2)) from (N, 2) samples.
+    Least squares of a x^2 + b y^2 + 2c xy + 2d x + 2e y = 1."""
+    samples = np.asarray(samples, dtype=np.float64)
+    scale = np.abs(samples).max()
+    x, y = (samples / scale).T
+    design = np.column_stack((x * x, y * y, 2 * x * y, 2 * x, 2 * y))
+    a, b, c, d, e = np.linalg.lstsq(design, np.ones(len(x)), rcond=None)[0]
+    conic = np.array([[a, c], [c, b]])
+    center = -np.linalg.solve(conic, [d, e])
+    conic /= 1 + center @ conic @ center
+    return center * scale, _sphere_matrix(conic) / scale
+
+
+def _sphere_matrix(quadric):
+    """Symmetric square root of a positive definite quadric, what maps its ellipsoid to the unit sphere"""
+    values, vectors = np.linalg.eigh(quadric)
+    if values.min() <= 0:
+        raise ValueError("samples don't look like an ellipsoid, turn the device around more")
+    return vectors @ np.diag(np.sqrt(values)) @ vectors.T
+
+
+class Calibration:
+    """corrected = matrix @ (raw - offset). The matrix keeps the ellipsoid's volume, so corrected samples
+    are about as big as raw ones and gauss() still roughly means something"""
+
+    def __init__(self, offset=(0.0, 0.0, 0.0), matrix=np.eye(3)):
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        (self._ox, self._oy, self._oz) = self.offset.tolist()
+        (self._m00, self._m01, self._m02), (self._m10, self._m11, self._m12), (self._m20, self._m21, self._m22) = \
+            self.matrix.tolist()
+
+    @classmethod
+    def fit(cls, samples):
+        samples = np.asarray(samples, dtype=np.float64)[:, :3]
+        if len(samples) < MIN_SAMPLES:
+            raise ValueError(f"only {len(samples)} samples, need at least {MIN_SAMPLES}")
+        spread = samples.max(axis=0) - samples.min(axis=0)
+        if spread[2] < FLAT_RATIO * spread[:2].min():
+            offset2, matrix2 = fit_ellipse(samples[:, :2])
+            offset = np.append(offset2, 0.0)
+            matrix = np.eye(3)
+            matrix[:2, :2] = matrix2 / np.sqrt(np.linalg.det(matrix2))
+        else:
+            offset, matrix = fit_ellipsoid(samples)
+            matrix /= np.cbrt(np.linalg.det(matrix))
+        return cls(offset, matrix)
+
+    def apply(self, x, y, z):
+        """One raw sample, corrected"""
+        x -= self._ox
+        y -= self._oy
+        z -= self._oz
+        return (self._m00 * x + self._m01 * y + self._m02 * z,
+                self._m10 * x + self._m11 * y + self._m12 * z,
+                self._m20 * x + self._m21 * y + self._m22 * z)
+
+    def apply_all(self, samples):
+        """(N, 3) raw samples, corrected"""
+        return (np.asarray(samples, dtype=np.float64)[:, :3] - self.offset) @ self.matrix.T
+
+    def save(self, path=CALIBRATION_FILE):
+        with open(path, 'w') as f:
+            json.dump({'offset': self.offset.tolist(), 'matrix': self.matrix.tolist(),
+                       'saved': time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=1)
+
+    @classmethod
+    def load(cls, path=CALIBRATION_FILE):
+        """The saved calibration, or one that changes nothing if the device hasn't been calibrated"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            saved = json.load(f)
+        return cls(saved['offset'], saved['matrix'])
+
+
+def heading_spread(samples):
+    """How far a set of corrected samples is from a circle in x/y, max/min radius (1 is perfect)"""
+    radius = np.hypot(samples[:, 0], samples[:, 1])
+    return radius.max() / radius.min()
+
+
+def collect(seconds):
+    """Raw samples from the chip for a while, showing how much of the circle has been covered"""
+    from magnetometer import HMC5883L
+    chip = HMC5883L(rate_hz=75, averaging=1)
+    samples = []
+    seen = np.zeros(36, dtype=bool)
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sample = chip.read()
+        if sample is None:
+            continue
+        samples.append(sample)
+        seen[int(np.degrees(np.arctan2(sample[1], sample[0])) % 360) // 10] = True
+        print(f"\r{len(samples)} samples, {seen.sum() * 10} of 360 degrees covered, "
+              f"{end - time.monotonic():4.1f}s left  ", end='')
+    print()
+    return np.array(samples, dtype=np.float64)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ['--trace']:
+        from magnetometer import read_trace
+        samples = np.array(read_trace(args[1]))[:, 1:]
+        out = args[2] if len(args) > 2 else CALIBRATION_FILE
+    else:
+        seconds = float(args[0]) if args else 30
+        out = args[1] if len(args) > 1 else CALIBRATION_FILE
+        print(f"turn the device slowly through every direction (and tilt it) for {seconds:g}s")
+        samples = collect(seconds)
+    calibration = Calibration.fit(samples)
+    print(f"offset {np.round(calibration.offset, 1).tolist()}")
+    print(f"matrix {np.round(calibration.matrix, 4).tolist()}")
+    print(f"x/y radius spread {heading_spread(samples):.3f} raw, "
+          f"{heading_spread(calibration.apply_all(samples)):.3f} calibrated")
+    calibration.save(out)
+    print(f"saved {out}")
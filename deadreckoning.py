@@ -0,0 +1,87 @@
+"""Position between GPS fixes, so the distance and arrow move smoothly instead of jumping once a fix.
+
+The receiver gives a fix about once a second but the screen redraws 10 times a second. Predictor
+keeps an alpha-beta filter of position and velocity fed by every fix, with RMC's speed and course
+(measured from the doppler shift, better than differencing noisy positions) pulling the velocity
+towards them, and predict() carries the position forward along that velocity to the current time.
+Below a walking pace GPS speed is mostly noise, so standing still stays still.
+"""
+import math
+import time
+
+from geodesy import EARTH_RADIUS_M
+
+M_PER_DEG = EARTH_RADIUS_M * math.pi / 180
+MIN_DT_S = 0.05  # closer fixes than this would blow up the velocity correction (GPSReader drops repeats of a fix)
+
+
+class Predictor:
+    """alpha and beta are how much of the position and velocity error of each fix gets corrected,
+    course_gain how much of the way to RMC's velocity the velocity goes on each fix"""
+
+    def __init__(self, alpha=0.4, beta=0.1, course_gain=0.7, max_extrapolate_s=2.0, min_speed_mps=0.5):
+        self.alpha = alpha
+        self.beta = beta
+        self.course_gain = course_gain
+        self.max_extrapolate_s = max_extrapolate_s
+        self.min_speed_mps = min_speed_mps
+        # (time, lat, lon, north m/s, east m/s) in one tuple, so the gps thread can replace it
+        # while another thread predicts from it
+        self.state = None
+        self.updates = 0
+
+    def update(self, fix):
+        """Takes a gps.Fix (anything with lat lon valid time speed_mps course_deg)"""
+        if not fix.valid or fix.lat is None:
+            return
+        measured_v = self._fix_velocity(fix)
+        state = self.state
+        if state is None:
+            self.state = (fix.time, fix.lat, fix.lon) + (measured_v or (0.0, 0.0))
+            self.updates += 1
+            return
+        t, lat, lon, vn, ve = state
+        dt = fix.time - t
+        if dt < MIN_DT_S:
+            return
+
+        # predict to the fix's time and correct with what it measured, in meters around the prediction
+        m_per_deg_lon = M_PER_DEG * math.cos(math.radians(lat))
+        lat += vn * dt / M_PER_DEG
+        lon += ve * dt / m_per_deg_lon
+        rn = (fix.lat - lat) * M_PER_DEG
+        re = (fix.lon - lon) * m_per_deg_lon
+        lat += self.alpha * rn / M_PER_DEG
+        lon += self.alpha * re / m_per_deg_lon
+        vn += self.beta * rn / dt
+        ve += self.beta * re / dt
+        if measured_v is not None:
+            vn += self.course_gain * (measured_v[0] - vn)
+            ve += self.course_gain * (measured_v[1] - ve)
+        if math.hypot(vn, ve) < self.min_speed_mps:
+            vn = ve = 0.0
+        self.state = (fix.time, lat, lon, vn, ve)
+        self.updates += 1
+
+    def _fix_velocity(self, fix):
+        if fix.course_deg is None:
+            return None
+        if fix.speed_mps < self.min_speed_mps:
+            return 0.0, 0.0
+        course = math.radians(fix.course_deg)
+        return fix.speed_mps * math.cos(course), fix.speed_mps * math.sin(course)
+
+    def predict(self, now=None):
+        """(lat, lon) carried forward to now (time.monotonic() like Fix.time), None before the first fix.
+        Stops extrapolating max_extrapolate_s after the last fix, a lost fix shouldn't walk off forever."""
+        state = self.state
+        if state is None:
+            return None
+        t, lat, lon, vn, ve = state
+        now = time.monotonic() if now is None else now
+        dt = min(max(now - t, 0.0), self.max_extrapolate_s)
+        return lat + vn * dt / M_PER_DEG, lon + ve * dt / (M_PER_DEG * math.cos(math.radians(lat)))
+
+    def speed(self):
+        state = self.state
+        return math.hypot(state[3], state[4]) if state else 0.0
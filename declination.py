@@ -0,0 +1,163 @@
+"""Magnetic declination from the World Magnetic Model, precomputed on a grid over the stores.
+
+tree.py evaluates the WMM (coefficients in data/WMM.COF, straight from NOAA, no network) at the
+corners of a declination grid covering the index's bounding box and saves it in the index as one
+small float32 array. At runtime DeclinationGrid.at() interpolates between the 4 corners of the cell
+you're in, and keeps those corners around so a heading sample in the same cell is a few float
+multiplies. Outside the box the nearest edge value is used.
+
+Values have the same sign as the old Toronto/Kingston constants in geodesy.py (west positive,
+radians, what get_heading adds to atan2(y, x)), so the compasses point the same way they did.
+"""
+import datetime
+import math
+import os
+import sys
+
+import numpy as np
+
+WMM_COF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'WMM.COF')
+DECLINATION_RES_DEG = 0.25  # declination changes about a degree per 100 km around here, so plenty
+MODEL_YEARS = 5  # each WMM release is good for 5 years from its epoch
+
+# WGS84 ellipsoid and the model's reference radius, km
+WGS84_A = 6378.137
+WGS84_E2 = 1 / 298.257223563 * (2 - 1 / 298.257223563)
+WMM_RADIUS = 6371.2
+
+
+def read_cof(path=WMM_COF):
+    """(epoch, model name, g, h, g per year, h per year) with the coefficients as (n + 1, n + 1) arrays in nT"""
+    with open(path) as f:
+        epoch, model = f.readline().split()[:2]
+        rows = []
+        for line in f:
+            if line.startswith('9999'):
+                break
+            rows.append([float(v) for v in line.split()])
+    rows = np.array(rows)
+    n_max = int(rows[:, 0].max())
+    coefs = np.zeros((4, n_max + 1, n_max + 1))
+    n, m = rows[:, 0].astype(int), rows[:, 1].astype(int)
+    coefs[:, n, m] = rows[:, 2:6].T
+    return (float(epoch), model) + tuple(coefs)
+
+
+def decimal_year(date=None):
+    date = date or datetime.date.today()
+    start = datetime.date(date.year, 1, 1)
+    return date.year + (date - start).days / (datetime.date(date.year + 1, 1, 1) - start).days
+
+
+def wmm_declination(lat_deg, lon_deg, year, model=None, height_km=0.0):
+    """WMM declination in degrees (east positive, the usual sign) for arrays of points at height_km
+    above the ellipsoid. model is read_cof()'s result."""
+    epoch, _, g0, h0, g_dot, h_dot = model or read_cof()
+    g = g0 + (year - epoch) * g_dot
+    h = h0 + (year - epoch) * h_dot
+    n_max = g.shape[0] - 1
+
+    lat, lon = np.broadcast_arrays(np.asarray(lat_deg, dtype=np.float64), np.asarray(lon_deg, dtype=np.float64))
+    shape = lat.shape
+    lat, lon = np.radians(lat.ravel()), np.radians(lon.ravel())
+
+    # geodetic -> geocentric spherical
+    rc = WGS84_A / np.sqrt(1 - WGS84_E2 * np.sin(lat) ** 2)
+    p = (rc + height_km) * np.cos(lat)
+    z = (rc * (1 - WGS84_E2) + height_km) * np.sin(lat)
+    r = np.hypot(p, z)
+    lat_c = np.arcsin(z / r)
+
+    # Schmidt semi-normalised associated Legendre functions of cos(colatitude) and their colatitude derivatives
+    x, s = np.sin(lat_c), np.cos(lat_c)
+    P = np.zeros((n_max + 1, n_max + 1) + lat.shape)
+    dP = np.zeros_like(P)
+    P[0, 0] = 1
+    for n in range(1, n_max + 1):
+        k = 1.0 if n == 1 else math.sqrt((2 * n - 1) / (2 * n))
+        P[n, n] = k * s * P[n - 1, n - 1]
+        dP[n, n] = k * (s * dP[n - 1, n - 1] + x * P[n - 1, n - 1])
+        for m in range(n):
+            back = math.sqrt((n - 1) ** 2 - m ** 2)
+            norm = math.sqrt(n ** 2 - m ** 2)
+            P[n, m] = ((2 * n - 1) * x * P[n - 1, m] - back * P[n - 2, m]) / norm
+            dP[n, m] = ((2 * n - 1) * (x * dP[n - 1, m] - s * P[n - 1, m]) - back * dP[n - 2, m]) / norm
+
+    m = np.arange(n_max + 1)[:, None]
+    cos_ml, sin_ml = np.cos(m * lon), np.sin(m * lon)
+    b_r, b_theta, b_phi = np.zeros((3,) + lat.shape)
+    for n in range(1, n_max + 1):
+        ratio = (WMM_RADIUS / r) ** (n + 2)
+        gn, hn = g[n, :n + 1, None], h[n, :n + 1, None]
+        terms = gn * cos_ml[:n + 1] + hn * sin_ml[:n + 1]
+        b_r += ratio * (n + 1) * (terms * P[n, :n + 1]).sum(axis=0)
+        b_theta -= ratio * (terms * dP[n, :n + 1]).sum(axis=0)
+        b_phi += ratio * (m[:n + 1] * (gn * sin_ml[:n + 1] - hn * cos_ml[:n + 1]) * P[n, :n + 1]).sum(axis=0) / s
+
+    # north/east/down in the geocentric frame, then north rotated back to the ellipsoid
+    north_c, east, down_c = -b_theta, b_phi, -b_r
+    north = north_c * np.cos(lat_c - lat) - down_c * np.sin(lat_c - lat)
+    return np.degrees(np.arctan2(east, north)).reshape(shape)[()]
+
+
+def build_declination_grid(stores_deg, res_deg=DECLINATION_RES_DEG, year=None, path=WMM_COF):
+    """(header entry, arrays) for the index: declination at the corners of res_deg cells covering the stores"""
+    model = read_cof(path)
+    epoch, name = model[:2]
+    year = decimal_year() if year is None else year
+    if not epoch <= year <= epoch + MODEL_YEARS:
+        print(f"{name} is for {epoch:g} to {epoch + MODEL_YEARS:g}, declination for {year:.2f} will be off "
+              f"(get a newer WMM.COF from NOAA)", file=sys.stderr)
+    stores_deg = np.asarray(stores_deg, dtype=np.float64)
+    lat0, lon0 = stores_deg.min(axis=0) - res_deg
+    lat1, lon1 = stores_deg.max(axis=0) + res_deg
+    rows = int(np.ceil((lat1 - lat0) / res_deg))
+    cols = int(np.ceil((lon1 - lon0) / res_deg))
+    lats = lat0 + res_deg * np.arange(rows + 1)
+    lons = lon0 + res_deg * np.arange(cols + 1)
+    degrees = wmm_declination(lats[:, None], lons[None, :], year, model)
+    header = {'model': name, 'year': round(year, 3), 'lat0': float(lat0), 'lon0': float(lon0), 'res': res_deg,
+              'rows': rows, 'cols': cols}
+    return header, {'declination': np.radians(-degrees).astype(np.float32)}
+
+
+class DeclinationGrid:
+    """at(lat, lon) -> declination in radians, bilinear between the corners of the grid cell"""
+
+    def __init__(self, header, values):
+        self.lat0 = header['lat0']
+        self.lon0 = header['lon0']
+        self.inv_res = 1 / header['res']
+        self.rows = header['rows']
+        self.cols = header['cols']
+        self.year = header['year']
+        self.values = np.asarray(values)
+        self._cell = None
+        self._corners = None
+
+    def at(self, lat_deg, lon_deg):
+        fy = min(max((lat_deg - self.lat0) * self.inv_res, 0.0), self.rows)
+        fx = min(max((lon_deg - self.lon0) * self.inv_res, 0.0), self.cols)
+        row = min(int(fy), self.rows - 1)
+        col = min(int(fx), self.cols - 1)
+        if (row, col) != self._cell:  # the 4 corners only get read again when we change cells
+            self._corners = self.values[row:row + 2, col:col + 2].ravel().tolist()
+            self._cell = (row, col)
+        fy -= row
+        fx -= col
+        d00, d01, d10, d11 = self._corners
+        return (d00 * (1 - fx) + d01 * fx) * (1 - fy) + (d10 * (1 - fx) + d11 * fx) * fy
+
+
+def load_declination(header, arrays):
+    """The DeclinationGrid saved in a store index, None for indexes built before there was one"""
+    if not header.get('declination') or 'declination' not in arrays:
+        return None
+    return DeclinationGrid(header['declination'], arrays['declination'])
+
+
+if __name__ == "__main__":
+    # python declination.py lat lon [year], straight from the model
+    lat, lon = float(sys.argv[1]), float(sys.argv[2])
+    year = float(sys.argv[3]) if len(sys.argv) > 3 else decimal_year()
+    print(f"{wmm_declination(lat, lon, year):.2f} degrees (east positive) in {year:.2f}")
@@ -0,0 +1,103 @@
+"""Drawing straight into the SSD1306's own memory layout with numpy, no PIL image per frame.
+
+The buffer is 1024 bytes, 8 pages of 128 columns, each byte being 8 pixels of a column with bit 0
+at the top, so it goes to oled.PartialDisplay as is without the image -> buffer conversion the
+adafruit driver does. Lines and circles are computed for all their pixels at once, and text uses
+the usual 5x7 OLED font whose glyphs are already column bytes.
+"""
+import math
+
+import numpy as np
+
+WIDTH, HEIGHT = 128, 64
+
+# 5x7 font, one byte per column, bit 0 at the top (same as adafruit's glcdfont)
+FONT_5X7 = {
+    '0': (0x3E, 0x51, 0x49, 0x45, 0x3E), '1': (0x00, 0x42, 0x7F, 0x40, 0x00),
+    '2': (0x42, 0x61, 0x51, 0x49, 0x46), '3': (0x21, 0x41, 0x45, 0x4B, 0x31),
+    '4': (0x18, 0x14, 0x12, 0x7F, 0x10), '5': (0x27, 0x45, 0x45, 0x45, 0x39),
+    '6': (0x3C, 0x4A, 0x49, 0x49, 0x30), '7': (0x01, 0x71, 0x09, 0x05, 0x03),
+    '8': (0x36, 0x49, 0x49, 0x49, 0x36), '9': (0x06, 0x49, 0x49, 0x29, 0x1E),
+    'm': (0x7C, 0x04, 0x18, 0x04, 0x78), 'k': (0x7F, 0x10, 0x28, 0x44, 0x00),
+    '.': (0x00, 0x60, 0x60, 0x00, 0x00), '-': (0x08, 0x08, 0x08, 0x08, 0x08),
+    ' ': (0x00, 0x00, 0x00, 0x00, 0x00),
+}
+FONT_ADVANCE = 6  # 5 columns and a gap
+
+
+def _padded(font, advance):
+    return {char: np.array(columns + (0,) * (advance - len(columns)), dtype=np.uint16) for char, columns in font.items()}
+
+
+_FONT_COLUMNS = _padded(FONT_5X7, FONT_ADVANCE)
+
+
+class FrameBuffer:
+    """A reusable SSD1306 frame. pages is a (8, 128) view of buffer, both are what gets sent."""
+
+    def __init__(self, width=WIDTH, height=HEIGHT):
+        self.width = width
+        self.height = height
+        self.buffer = np.zeros(width * height // 8, dtype=np.uint8)
+        self.pages = self.buffer.reshape(height // 8, width)
+        self._bit = (1 << np.arange(8)).astype(np.uint8)
+
+    def clear(self):
+        self.buffer[:] = 0
+
+    def pixels(self, x, y):
+        """Sets every (x[i], y[i]), anything off screen is ignored"""
+        x = np.asarray(x, dtype=np.intp)
+        y = np.asarray(y, dtype=np.intp)
+        keep = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        x, y = x[keep], y[keep]
+        np.bitwise_or.at(self.pages, (y >> 3, x), self._bit[y & 7])
+
+    def line(self, x0, y0, x1, y1, width=1):
+        """Straight line, width pixels thick across its shorter direction"""
+        n = int(max(abs(x1 - x0), abs(y1 - y0))) + 1
+        x = np.rint(np.linspace(x0, x1, n)).astype(np.intp)
+        y = np.rint(np.linspace(y0, y1, n)).astype(np.intp)
+        if width > 1:
+            offsets = np.arange(width) - (width - 1) // 2
+            if abs(x1 - x0) >= abs(y1 - y0):
+                x, y = np.tile(x, width), (y[None, :] + offsets[:, None]).ravel()
+            else:
+                x, y = (x[None, :] + offsets[:, None]).ravel(), np.tile(y, width)
+        self.pixels(x, y)
+
+    def circle(self, cx, cy, r):
+        """1 pixel outline"""
+        t = np.linspace(0, 2 * math.pi, int(8 * r) + 8, endpoint=False)
+        self.pixels(np.rint(cx + r * np.cos(t)), np.rint(cy + r * np.sin(t)))
+
+    def blit(self, columns, x, y):
+        """ORs in a glyph given as column bytes (bit 0 = top row) with its top left at (x, y).
+        y doesn't have to be on a page boundary, the bits get shifted across two pages."""
+        columns = np.asarray(columns, dtype=np.uint16)
+        cols = np.arange(x, x + len(columns))
+        keep = (cols >= 0) & (cols < self.width)
+        cols, columns = cols[keep], columns[keep]
+        page, shift = divmod(y, 8)
+        shifted = columns << shift
+        for p, part in ((page, shifted & 0xFF), (page + 1, shifted >> 8)):
+            if 0 <= p < self.height // 8:
+                self.pages[p, cols] |= part.astype(np.uint8)
+
+    def text(self, string, x, y, font=FONT_5X7, advance=FONT_ADVANCE):
+        """Whole string in one blit, characters the font doesn't have are left blank. Returns the x after it."""
+        columns = _FONT_COLUMNS if font is FONT_5X7 else _padded(font, advance)
+        blank = np.zeros(advance, dtype=np.uint16)
+        if string:
+            self.blit(np.concatenate([columns.get(char, blank) for char in string]), x, y)
+        return x + advance * len(string)
+
+
+def font_masks(font=FONT_5X7, advance=FONT_ADVANCE):
+    """{char: (8, advance) bool mask} of a column byte font, for sprites.Atlas"""
+    masks = {}
+    for char, columns in font.items():
+        mask = np.zeros((8, advance), dtype=bool)
+        mask[:, :len(columns)] = np.unpackbits(np.array(columns, dtype=np.uint8)[None, :], axis=0, bitorder='little')
+        masks[char] = mask
+    return masks
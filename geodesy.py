@@ -0,0 +1,147 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000  # earth radius in meters
+RAD = np.pi / 180
+
+# saved declinations (radians), see get_local_declination
+TORONTO = (43.7, -79.4)
+KINGSTON = (44.2, -76.5)
+DECLINATION_TORONTO = 0.1972222
+DECLINATION_KINGSTON = 0.244346
+
+# All the functions here take degrees and work on plain floats or on any arrays that broadcast together.
+# Pass out= (and work= from workspace()) in hot loops and they won't allocate anything.
+# Plain floats take a math-module path since numpy's per-call overhead is bigger than the maths for one point.
+
+
+def workspace(shape):
+    """Scratch buffers for the out= versions below, make it once and reuse it"""
+    if isinstance(shape, int):
+        shape = (shape,)
+    return np.empty((3,) + tuple(shape))
+
+
+def _prepare(out, work, *args):
+    if out is None:
+        out = np.empty(np.broadcast_shapes(*(np.shape(a) for a in args)))
+    if work is None:
+        work = np.empty((3,) + out.shape)
+    return out, work
+
+
+def _is_scalar(*args):
+    return all(isinstance(a, (float, int)) for a in args)
+
+
+def _scalar_haversine(lat1, lon1, lat2, lon2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_M * c
+
+
+def _scalar_bearing(lat1, lon1, lat2, lon2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    x = math.sin(delta_lambda) * math.cos(phi2)
+    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(delta_lambda)
+    return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+
+def haversine(lat1, lon1, lat2, lon2, out=None, work=None):
+    """Great circle distance in meters"""
+    if out is None and _is_scalar(lat1, lon1, lat2, lon2):
+        return _scalar_haversine(lat1, lon1, lat2, lon2)
+    out, work = _prepare(out, work, lat1, lon1, lat2, lon2)
+    a, b = work[0, ...], work[1, ...]
+
+    # sin^2(delta_phi / 2)
+    np.subtract(lat2, lat1, out=a)
+    np.multiply(a, RAD / 2, out=a)
+    np.sin(a, out=a)
+    np.square(a, out=a)
+
+    # cos(phi1) * cos(phi2) * sin^2(delta_lambda / 2)
+    np.subtract(lon2, lon1, out=b)
+    np.multiply(b, RAD / 2, out=b)
+    np.sin(b, out=b)
+    np.square(b, out=b)
+    np.multiply(lat1, RAD, out=out)
+    np.cos(out, out=out)
+    np.multiply(b, out, out=b)
+    np.multiply(lat2, RAD, out=out)
+    np.cos(out, out=out)
+    np.multiply(b, out, out=b)
+
+    # 2 * atan2(sqrt(a), sqrt(1 - a)) is the same as 2 * asin(sqrt(a)) and needs no extra buffer
+    np.add(a, b, out=a)
+    np.minimum(a, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=out)
+    np.multiply(out, 2 * EARTH_RADIUS_M, out=out)
+    return out[()]
+
+
+def calculate_bearing(lat1, lon1, lat2, lon2, out=None, work=None):
+    """Initial bearing from point 1 to point 2 in degrees, 0 = north, clockwise"""
+    if out is None and _is_scalar(lat1, lon1, lat2, lon2):
+        return _scalar_bearing(lat1, lon1, lat2, lon2)
+    out, work = _prepare(out, work, lat1, lon1, lat2, lon2)
+    dl, t, x = work[0, ...], work[1, ...], work[2, ...]
+
+    np.subtract(lon2, lon1, out=dl)
+    np.multiply(dl, RAD, out=dl)
+
+    # x = sin(delta_lambda) * cos(phi2)
+    np.multiply(lat2, RAD, out=t)
+    np.cos(t, out=t)
+    np.sin(dl, out=x)
+    np.multiply(x, t, out=x)
+
+    # y = cos(phi1) * sin(phi2) - sin(phi1) * cos(phi2) * cos(delta_lambda)
+    np.cos(dl, out=dl)
+    np.multiply(dl, t, out=dl)
+    np.multiply(lat1, RAD, out=out)
+    np.sin(out, out=out)
+    np.multiply(dl, out, out=dl)
+    np.multiply(lat2, RAD, out=t)
+    np.sin(t, out=t)
+    np.multiply(lat1, RAD, out=out)
+    np.cos(out, out=out)
+    np.multiply(t, out, out=t)
+    np.subtract(t, dl, out=t)
+
+    np.arctan2(x, t, out=out)
+    np.multiply(out, 1 / RAD, out=out)
+    np.add(out, 360, out=out)
+    np.mod(out, 360, out=out)
+    return out[()]
+
+
+#Some bullshit called true and magnetic north forced me to make this function, it just gives an output for adjusted heading
+def get_local_declination(lat, lon, out=None, work=None):
+    """Magnetic declination in radians, whichever of toronto or kingston is closer.
+    Only used when the store index has no WMM declination grid (see declination.py)"""
+    if out is None and _is_scalar(lat, lon):
+        if _scalar_haversine(lat, lon, *TORONTO) <= _scalar_haversine(lat, lon, *KINGSTON):
+            return DECLINATION_TORONTO
+        return DECLINATION_KINGSTON
+    out, work = _prepare(out, work, lat, lon)
+    dist_to_kingston = work[2, ...]
+    haversine(lat, lon, *KINGSTON, out=dist_to_kingston, work=work)
+    haversine(lat, lon, *TORONTO, out=out, work=work)
+
+    # 1 where toronto is closer (or tied), 0 otherwise, then pick between the two saved values
+    np.subtract(dist_to_kingston, out, out=out)
+    np.heaviside(out, 1.0, out=out)
+    np.multiply(out, DECLINATION_TORONTO - DECLINATION_KINGSTON, out=out)
+    np.add(out, DECLINATION_KINGSTON, out=out)
+    return out[()]
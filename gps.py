@@ -0,0 +1,116 @@
+"""Background GPS reader: keeps the serial port open and reads every NMEA sentence on its own thread.
+
+The old get_gps_coords() opened /dev/ttyAMA0 for every call, waited up to 0.5 s for one line and
+threw it away unless it was $GPRMC, all inside the main loop. Here a thread consumes the whole
+stream and publishes the latest fix as one immutable Fix tuple. Swapping an attribute is atomic
+in python, so the render loop just reads gps.fix, never waits and never sees half a fix.
+Give it a deadreckoning.Predictor and position() fills in the time between fixes.
+"""
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import nmea
+
+# time is time.monotonic() when the sentence came in, valid is the RMC status flag (A = valid, V = no fix)
+# or GGA's quality > 0. RMC brings speed and course, GGA fix quality and HDOP, each fix keeps the
+# latest of the other kind's values.
+Fix = namedtuple('Fix', 'lat lon valid time speed_mps course_deg quality hdop')
+NO_FIX = Fix(None, None, False, 0.0, 0.0, None, 0, None)
+
+
+class GPSReader:
+    """Reads the port (or any stream with readline(), e.g. a log file) until stop()"""
+
+    RETRY_S = 1.0  # wait before reopening the port after an error
+
+    def __init__(self, port="/dev/ttyAMA0", baudrate=9600, stream=None, predictor=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.stream = stream
+        self.predictor = predictor  # gets every valid fix once, position() asks it where we are now
+        self._predicted_utc = None  # UTC time of the last fix the predictor got
+        self.fix = None  # latest Fix, valid or not
+        self.last_valid = None  # latest Fix with a position
+        self.sentences = 0
+        self.fixes = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='gps', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _open(self):
+        import serial
+        # the timeout only matters for noticing stop(), readline() returns as soon as a line is in
+        return serial.Serial(self.port, baudrate=self.baudrate, timeout=0.5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                stream = self.stream if self.stream is not None else self._open()
+                try:
+                    self._consume(stream)
+                finally:
+                    if stream is not self.stream:
+                        stream.close()
+                if self.stream is not None:
+                    return  # a log file has ended
+            except OSError as e:  # serial.SerialException is one too
+                self.errors += 1
+                print(f"GPS error: {e}", file=sys.stderr)
+                self._stop.wait(self.RETRY_S)
+
+    def _consume(self, stream):
+        while not self._stop.is_set():
+            line = stream.readline()
+            if not line:
+                if self.stream is not None:
+                    return
+                continue
+            self.feed(line)
+
+    def feed(self, line, now=None):
+        """Takes one raw NMEA line, returns the new Fix if it was RMC/GGA (None otherwise)"""
+        self.sentences += 1
+        msg = nmea.parse(line)
+        if msg is None:
+            return None
+        now = time.monotonic() if now is None else now
+        old = self.fix or NO_FIX
+        if msg.kind == nmea.RMC:
+            fix = Fix(msg.lat, msg.lon, msg.valid, now, msg.speed_mps or 0.0, msg.course_deg, old.quality, old.hdop)
+        else:
+            fix = Fix(msg.lat, msg.lon, msg.valid, now, old.speed_mps, old.course_deg, msg.quality, msg.hdop)
+        self.fixes += 1
+        self.fix = fix
+        if fix.valid:
+            self.last_valid = fix
+            # RMC and GGA of one fix come ~0.1 s apart at 9600 baud, only the first of them counts
+            if self.predictor is not None and (msg.utc is None or msg.utc != self._predicted_utc):
+                self._predicted_utc = msg.utc
+                self.predictor.update(fix)
+        return fix
+
+    def position(self, max_age_s=None, now=None):
+        """(lat, lon) of the latest valid fix, None if there isn't one (or it's older than max_age_s).
+        With a predictor it's where that fix's speed and course put us by now."""
+        fix = self.last_valid
+        now = time.monotonic() if now is None else now
+        if fix is None or (max_age_s is not None and now - fix.time > max_age_s):
+            return None
+        if self.predictor is not None:
+            return self.predictor.predict(now)
+        return fix.lat, fix.lon
+
+    def stats(self):
+        return {'sentences': self.sentences, 'fixes': self.fixes, 'errors': self.errors}
@@ -0,0 +1,183 @@
+"""Lat/lon grid over the stores' bounding box that answers most nearest-store questions with one array read.
+
+Each cell holds the index of the store that is nearest to every point in the cell, when only one store
+can be. Cells on a boundary between stores point at a short candidate list instead, and the nearest of
+those few gets picked with plain haversines. Cells with too many candidates (cities) get split into a
+finer subgrid that works the same way, and only sub cells that are still too crowded leave it to the tree.
+
+A store s can only be nearest to some point of a cell if dist(center, s) <= d1 + 2 * r, where d1 is the
+distance from the cell center to its nearest store and r is the distance from the center to the
+farthest corner, so the candidates are the stores inside that radius. The answer stays right until the
+point leaves its cell (or, on a boundary, moves half the gap to the runner-up), which NearestCache uses
+as its safe radius.
+"""
+import math
+
+import numpy as np
+
+from geodesy import EARTH_RADIUS_M, haversine
+
+GRID_RES_DEG = 0.05
+SUBDIVIDE = 8  # cells with too many candidates get split into SUBDIVIDE x SUBDIVIDE smaller ones
+# only near stores though, far away cells see a whole distant city as candidates and splitting doesn't help
+SUBDIVIDE_WITHIN_M = 20000
+MAX_CANDIDATES = 16
+EDGE_MARGIN_M = 1.0  # widens every cell a little so float rounding at the edges doesn't matter
+
+# cell values: >= 0 is the nearest store, < 0 is entry -(value + 1) in the entries table, each entry
+# being (kind, start, end): a candidate list cand_stores[start:end] (empty = ask the tree) or a
+# subgrid sub_cells[start] whose values mean the same thing
+CANDIDATES, SUBGRID = 0, 1
+
+
+def _classify(tree, centers, res_deg, categories, n_stores, max_candidates):
+    """For square cells of res_deg around each center: nearest stores by distance (radians) and
+    index, how many of them could be the nearest somewhere in the cell, and whether that's more
+    than max_candidates"""
+    # farthest corner is on the side closer to the equator, where the cell is widest
+    half = res_deg / 2
+    lat = centers[:, 0]
+    corner_r = np.maximum(haversine(lat, 0.0, lat + half, half), haversine(lat, 0.0, lat - half, half))
+    reach = (2 * corner_r + EDGE_MARGIN_M) / EARTH_RADIUS_M
+
+    k = min(max_candidates + 1, n_stores)
+    dist, ind = tree.query(np.radians(centers), k=k, categories=categories)
+    n_candidates = (dist <= dist[:, :1] + reach[:, None]).sum(axis=1)
+    overflow = n_candidates > max_candidates
+    return dist, ind, n_candidates, overflow
+
+
+def _cell_centers(lat0, lon0, rows, cols, res_deg):
+    lat_c = lat0 + (np.arange(rows) + 0.5) * res_deg
+    lon_c = lon0 + (np.arange(cols) + 0.5) * res_deg
+    return np.stack(np.meshgrid(lat_c, lon_c, indexing='ij'), axis=-1).reshape(-1, 2)
+
+
+def build_grid(tree, stores_deg, categories, n_stores, res_deg=GRID_RES_DEG, max_candidates=MAX_CANDIDATES,
+               subdivide=SUBDIVIDE):
+    """(header entry, arrays) for one grid. tree is a numpy engine (it has to take categories=),
+    n_stores how many stores are in those categories."""
+    stores_deg = np.asarray(stores_deg, dtype=np.float64)
+    lat0, lon0 = stores_deg.min(axis=0) - res_deg
+    lat1, lon1 = stores_deg.max(axis=0) + res_deg
+    rows = int(np.ceil((lat1 - lat0) / res_deg))
+    cols = int(np.ceil((lon1 - lon0) / res_deg))
+
+    # entry 0 is the one empty candidate list every cell that gives up points at
+    entries = [(CANDIDATES, 0, 0)]
+    give_up = -len(entries)
+    cand_stores = []
+
+    def encode(ind, n_candidates, overflow):
+        """Cell values for one level, adding candidate lists for the ambiguous cells"""
+        cells = ind[:, 0].astype(np.int32)
+        for cell in np.flatnonzero((n_candidates > 1) & ~overflow):
+            entries.append((CANDIDATES, len(cand_stores), len(cand_stores) + n_candidates[cell]))
+            cand_stores.extend(ind[cell, :n_candidates[cell]])
+            cells[cell] = -len(entries)
+        return cells
+
+    centers = _cell_centers(lat0, lon0, rows, cols, res_deg)
+    dist, ind, n_candidates, overflow = _classify(tree, centers, res_deg, categories, n_stores, max_candidates)
+    cells = encode(ind, n_candidates, overflow)
+
+    # split the crowded cells, and give up (empty candidate list) on sub cells that are still crowded
+    # and on crowded cells too far from any store to be worth splitting
+    near = dist[:, 0] * EARTH_RADIUS_M <= SUBDIVIDE_WITHIN_M
+    crowded = np.flatnonzero(overflow & near)
+    cells[overflow & ~near] = give_up
+    sub_res = res_deg / subdivide
+    sub_centers = np.concatenate([_cell_centers(lat, lon, subdivide, subdivide, sub_res)
+                                  for lat, lon in centers[crowded] - res_deg / 2] or [np.empty((0, 2))])
+    _, sub_ind, sub_n, sub_overflow = _classify(tree, sub_centers, sub_res, categories, n_stores, max_candidates)
+    sub_cells = encode(sub_ind, sub_n, sub_overflow)
+    sub_cells[sub_overflow] = give_up
+    for block, cell in enumerate(crowded):
+        entries.append((SUBGRID, block, block + 1))
+        cells[cell] = -len(entries)
+
+    header = {'categories': [int(categories)], 'lat0': float(lat0), 'lon0': float(lon0), 'res': res_deg,
+              'rows': rows, 'cols': cols, 'subdivide': subdivide,
+              'unique_cells': int(np.count_nonzero(cells >= 0)), 'split_cells': int(len(crowded)),
+              'tree_cells': int(np.count_nonzero(overflow & ~near)), 'tree_sub_cells': int(sub_overflow.sum())}
+    arrays = {'cells': cells.reshape(rows, cols),
+              'sub_cells': sub_cells.reshape(-1, subdivide, subdivide),
+              'entries': np.array(entries, dtype=np.int32).reshape(-1, 3),
+              'cand_stores': np.array(cand_stores, dtype=np.int32)}
+    return header, arrays
+
+
+class GridLookup:
+    """Runtime side of build_grid, works straight off the memory mapped arrays"""
+
+    def __init__(self, header, cells, sub_cells, entries, cand_stores, stores_deg):
+        self.lat0 = header['lat0']
+        self.lon0 = header['lon0']
+        self.inv_res = 1 / header['res']
+        self.rows = header['rows']
+        self.cols = header['cols']
+        self.subdivide = header['subdivide']
+        # plain ndarray views of the memmaps (still backed by the files), indexing those is a lot cheaper
+        self.cells = np.asarray(cells)
+        self.sub_cells = np.asarray(sub_cells)
+        self.entries = np.asarray(entries)
+        self.cand_stores = np.asarray(cand_stores)
+        self.stores_deg = np.asarray(stores_deg)
+
+    def nearest(self, lat_deg, lon_deg):
+        """(index of the nearest store, meters the point can move without that changing), or (-1, 0.0)
+        if the point is off the grid or its cell needs the tree"""
+        y = (lat_deg - self.lat0) * self.inv_res
+        x = (lon_deg - self.lon0) * self.inv_res
+        row = math.floor(y)
+        col = math.floor(x)
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return -1, 0.0
+        cell = int(self.cells[row, col])
+        size = 1.0
+        if cell < 0:
+            kind, start, end = self.entries[-cell - 1].tolist()
+            if kind == SUBGRID:
+                size = 1 / self.subdivide
+                y, x = (y - row) * self.subdivide, (x - col) * self.subdivide
+                row, col = min(math.floor(y), self.subdivide - 1), min(math.floor(x), self.subdivide - 1)
+                cell = int(self.sub_cells[start, row, col])
+                if cell < 0:
+                    kind, start, end = self.entries[-cell - 1].tolist()
+        edge_m = self._to_edge(lat_deg, y - row, x - col, size)
+        if cell >= 0:
+            return cell, edge_m
+
+        # boundary cell: nearest of the candidates, and it stays nearest for half the gap to the runner-up
+        best, best_dist, second_dist = -1, float('inf'), float('inf')
+        candidates = self.cand_stores[start:end]
+        for store, (store_lat, store_lon) in zip(candidates.tolist(), self.stores_deg[candidates].tolist()):
+            d = haversine(lat_deg, lon_deg, store_lat, store_lon)
+            if d < best_dist:
+                best, best_dist, second_dist = store, d, best_dist
+            elif d < second_dist:
+                second_dist = d
+        if best < 0:
+            return -1, 0.0
+        return best, min(edge_m, (second_dist - best_dist) / 2)
+
+    def _to_edge(self, lat_deg, fy, fx, size):
+        """Meters from a point to the nearest side of its cell, fy/fx being its position inside
+        the cell in cell units and size the cell size in grid cells"""
+        res_rad = math.radians(size / self.inv_res)
+        dlat = min(fy, 1 - fy) * res_rad
+        dlon = min(fx, 1 - fx) * res_rad
+        # shortest way to a parallel is along the meridian, to a meridian it's the cross track distance
+        to_meridian = math.asin(min(1.0, math.sin(dlon) * math.cos(math.radians(lat_deg))))
+        return min(dlat, to_meridian) * EARTH_RADIUS_M
+
+
+def load_grids(header, arrays, stores_deg):
+    """{category mask: GridLookup} for every grid saved in a store index"""
+    grids = {}
+    for i, grid in enumerate(header.get('grids', [])):
+        lookup = GridLookup(grid, arrays[f'grid{i}_cells'], arrays[f'grid{i}_sub_cells'],
+                            arrays[f'grid{i}_entries'], arrays[f'grid{i}_cand_stores'], stores_deg)
+        for mask in grid['categories']:  # masks that pick the same stores share one grid
+            grids[mask] = lookup
+    return grids
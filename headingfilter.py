@@ -0,0 +1,91 @@
+"""Smoothing for the raw magnetometer heading, so the arrow stops jittering.
+
+Headings wrap around at 360, so averaging the numbers is wrong near north (359 and 1 average to 180).
+Both filters here average the heading as a unit vector (sin, cos) instead and turn the result back
+into an angle, and both keep a fixed amount of state made once up front, nothing per sample.
+
+CircularMean: plain average of the last `window` samples, kept as running sums over a ring buffer.
+Smoother: exponential smoothing of the vector (a complementary filter with nothing to complement yet),
+less state and a smoother response for the same delay.
+
+latency_s is how far behind the filtered heading runs when the device turns at a steady rate, which
+is what you trade for less jitter. make_filter turns it into a window size or smoothing factor.
+"""
+import math
+from array import array
+
+FILTERS = ('mean', 'smooth', 'none')
+RESUM_EVERY = 4096  # samples between recomputing the running sums from the ring, so rounding can't build up
+
+
+class CircularMean:
+    """Mean heading of the last window samples, degrees in, degrees out"""
+
+    def __init__(self, window=5):
+        self.window = window
+        self._sin = array('d', [0.0]) * window
+        self._cos = array('d', [0.0]) * window
+        self._sum_sin = 0.0
+        self._sum_cos = 0.0
+        self._next = 0
+        self._since_resum = 0
+
+    def update(self, heading_deg):
+        rad = math.radians(heading_deg)
+        s, c = math.sin(rad), math.cos(rad)
+        i = self._next
+        self._sum_sin += s - self._sin[i]
+        self._sum_cos += c - self._cos[i]
+        self._sin[i] = s
+        self._cos[i] = c
+        self._next = (i + 1) % self.window
+        self._since_resum += 1
+        if self._since_resum == RESUM_EVERY:
+            self._since_resum = 0
+            self._sum_sin = math.fsum(self._sin)
+            self._sum_cos = math.fsum(self._cos)
+        return math.degrees(math.atan2(self._sum_sin, self._sum_cos)) % 360
+
+    def latency(self, rate_hz):
+        return (self.window - 1) / 2 / rate_hz
+
+
+class Smoother:
+    """Exponentially smoothed heading, alpha is how much of each new sample gets in (1 = no smoothing)"""
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self._sin = None
+        self._cos = None
+
+    def update(self, heading_deg):
+        rad = math.radians(heading_deg)
+        if self._sin is None:  # start at the first sample instead of easing in from nothing
+            self._sin, self._cos = math.sin(rad), math.cos(rad)
+        else:
+            self._sin += self.alpha * (math.sin(rad) - self._sin)
+            self._cos += self.alpha * (math.cos(rad) - self._cos)
+        return math.degrees(math.atan2(self._sin, self._cos)) % 360
+
+    def latency(self, rate_hz):
+        return (1 - self.alpha) / self.alpha / rate_hz
+
+
+class Passthrough:
+    def update(self, heading_deg):
+        return heading_deg
+
+    def latency(self, rate_hz):
+        return 0.0
+
+
+def make_filter(kind='smooth', latency_s=0.2, rate_hz=15):
+    """A filter that lags about latency_s behind at rate_hz samples a second, kind being one of FILTERS"""
+    samples = latency_s * rate_hz
+    if kind == 'mean':
+        return CircularMean(max(1, round(2 * samples + 1)))
+    if kind == 'smooth':
+        return Smoother(1 / (1 + samples))
+    if kind == 'none':
+        return Passthrough()
+    raise ValueError(f"unknown heading filter {kind!r}, use one of {FILTERS}")
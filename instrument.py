@@ -0,0 +1,168 @@
+"""Cheap timing of the hot paths: latency histograms and counters, written out every so often.
+
+    instruments = Instruments(enabled=True, path='timings.jsonl')
+    find_closest_store = instruments.wrap('find_closest_store', find_closest_store)
+    instruments.count('frames')
+    instruments.start()   # flushes every flush_s on its own thread, stop() flushes one last time
+
+Each wrapped call takes two perf_counter_ns() reads and one bucket increment. The histogram has
+fixed buckets, two per power of two of nanoseconds (so a percentile is off by at most ~20%), and the
+bucket comes from int.bit_length, no search and no allocation. p50/p99 are read off the buckets,
+max is exact. Disabled, wrap() hands back the function itself, so there's nothing left to cost.
+
+Every flush is one JSON line per snapshot (appended to path, or printed if there's no path).
+"""
+import json
+import sys
+import threading
+import time
+
+BUCKETS = 2 * 64 + 2
+FLUSH_S = 10.0
+
+
+def _bucket(ns):
+    bits = ns.bit_length()
+    if bits < 2:
+        return bits
+    return 2 * bits - 2 + (ns >> (bits - 2) & 1)
+
+
+def _bucket_bounds(i):
+    """Smallest and largest ns that land in bucket i"""
+    if i < 2:
+        return i, i
+    bits, half = (i + 2) // 2, (i + 2) % 2
+    low = (1 << (bits - 1)) + half * (1 << (bits - 2))
+    return low, low + (1 << (bits - 2)) - 1
+
+
+class Histogram:
+    """Durations in ns, in fixed buckets. Plain lists, so a wrapped function's closure can bump them
+    without any attribute lookups"""
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.totals = [0, 0]  # total ns, max ns
+
+    @property
+    def n(self):
+        return sum(self.counts)
+
+    @property
+    def total_ns(self):
+        return self.totals[0]
+
+    @property
+    def max_ns(self):
+        return self.totals[1]
+
+    def record(self, ns):
+        self.counts[_bucket(ns)] += 1
+        self.totals[0] += ns
+        if ns > self.totals[1]:
+            self.totals[1] = ns
+
+    def percentile(self, q):
+        """Middle of the bucket the q-th percentile (0-100) falls in, never more than max"""
+        n = self.n
+        if not n:
+            return 0
+        target = q / 100 * n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                low, high = _bucket_bounds(i)
+                return min((low + high) // 2, self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        n = self.n
+        return {'n': n, 'mean_us': round(self.total_ns / n / 1e3, 3) if n else 0.0,
+                'p50_us': round(self.percentile(50) / 1e3, 3), 'p99_us': round(self.percentile(99) / 1e3, 3),
+                'max_us': round(self.max_ns / 1e3, 3)}
+
+
+class Instruments:
+    """Named histograms and counters, flushed to path (JSON lines) or stdout every flush_s seconds"""
+
+    def __init__(self, enabled=True, path=None, flush_s=FLUSH_S):
+        self.enabled = enabled
+        self.path = path
+        self.flush_s = flush_s
+        self.histograms = {}
+        self.counters = {}
+        self._started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        if not enabled:
+            self.count = _nothing
+
+    def histogram(self, name):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        return hist
+
+    def wrap(self, name, fn):
+        """fn, timed into the name histogram on every call (fn itself when disabled). A call that raises
+        isn't timed, a try/finally would cost every call that doesn't"""
+        if not self.enabled:
+            return fn
+        hist = self.histogram(name)
+        counts, totals = hist.counts, hist.totals
+        clock = time.perf_counter_ns
+
+        # _bucket and Histogram.record written out, a call and its lookups cost as much as the clock reads
+        def timed(*args, **kwargs):
+            start = clock()
+            result = fn(*args, **kwargs)
+            ns = clock() - start
+            bits = ns.bit_length()
+            counts[2 * bits - 2 + (ns >> (bits - 2) & 1) if bits > 1 else bits] += 1
+            totals[0] += ns
+            if ns > totals[1]:
+                totals[1] = ns
+            return result
+        timed.__name__ = getattr(fn, '__name__', name)
+        timed.__wrapped__ = fn
+        return timed
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        return {'t': round(time.monotonic() - self._started, 3),
+                'spans': {name: hist.summary() for name, hist in self.histograms.items()},
+                'counters': dict(self.counters)}
+
+    def flush(self):
+        if not self.enabled:
+            return
+        line = json.dumps(self.snapshot())
+        if self.path is None:
+            print(line, file=sys.stdout, flush=True)
+        else:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+    def start(self):
+        if self.enabled and self.flush_s:
+            self._thread = threading.Thread(target=self._run, name='instruments', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_s):
+            self.flush()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self.flush()
+
+
+def _nothing(*args, **kwargs):
+    pass
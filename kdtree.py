@@ -0,0 +1,198 @@
+"""Nearest store search with nothing but numpy, so the device doesn't need scikit-learn.
+
+The stores are split into a kd-tree on their 3D unit vectors (straight-line distance between
+unit vectors only ever grows with great circle distance, so boxes in 3D give valid bounds).
+The tree is flattened down to its leaves: each leaf is a padded row of store indices plus its
+bounding box. A query ranks the leaf boxes by how close they could possibly be, then checks
+leaves in that order until the next box can't beat the k-th best store found so far.
+Candidate distances use the exact haversine formula BallTree(metric='haversine') uses,
+so the answers are the same (ties between stores at identical coordinates can come back
+in either order).
+
+Each store can carry a category bitmask (bit i = header['category_names'][i]) and every leaf keeps
+the OR of its stores' masks, so a category filtered query never even looks at a leaf box with
+none of the wanted categories in it.
+"""
+import numpy as np
+
+LEAF_SIZE = 64
+ALL_CATEGORIES = 0xFFFFFFFF
+
+
+def unit_vectors(points_rad):
+    lat, lon = points_rad[..., 0], points_rad[..., 1]
+    cos_lat = np.cos(lat)
+    return np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1)
+
+
+def build_kdtree(stores_deg, category_mask=None, leaf_size=LEAF_SIZE):
+    """Arrays describing the flattened tree, these get saved in the store index next to stores_deg"""
+    xyz = unit_vectors(np.radians(np.asarray(stores_deg, dtype=np.float64)))
+    leaves = []
+    stack = [np.arange(len(xyz))]
+    while stack:
+        idx = stack.pop()
+        if len(idx) <= leaf_size:
+            leaves.append(idx)
+            continue
+        pts = xyz[idx]
+        dim = np.argmax(pts.max(axis=0) - pts.min(axis=0))  # split the widest side at the median
+        idx = idx[np.argsort(pts[:, dim], kind='stable')]
+        half = len(idx) // 2
+        stack.append(idx[half:])
+        stack.append(idx[:half])  # popped first, so leaves come out in depth first order
+
+    kd_index = np.full((len(leaves), leaf_size), -1, dtype=np.int32)
+    kd_lo = np.empty((len(leaves), 3))
+    kd_hi = np.empty((len(leaves), 3))
+    kd_mask = np.zeros(len(leaves), dtype=np.uint32)
+    for i, idx in enumerate(leaves):
+        kd_index[i, :len(idx)] = idx
+        kd_lo[i] = xyz[idx].min(axis=0)
+        kd_hi[i] = xyz[idx].max(axis=0)
+        if category_mask is not None:
+            kd_mask[i] = np.bitwise_or.reduce(category_mask[idx])
+    arrays = {'kd_index': kd_index, 'kd_lo': kd_lo, 'kd_hi': kd_hi}
+    if category_mask is not None:
+        arrays['kd_mask'] = kd_mask
+    return arrays
+
+
+def group_by_query(m, query_ind, store_ind, a):
+    """Per query arrays of (store indices, distances in radians) sorted by distance, shaped like
+    BallTree.query_radius(..., return_distance=True, sort_results=True) returns them, from the lists
+    of hits each chunk of the m queries found"""
+    ind = np.empty(m, dtype=object)
+    dist = np.empty(m, dtype=object)
+    if not m:  # no queries, no chunks
+        return ind, dist
+    query_ind, store_ind, a = np.concatenate(query_ind), np.concatenate(store_ind), np.concatenate(a)
+    order = np.lexsort((a, query_ind))
+    split = np.searchsorted(query_ind[order], np.arange(1, m))
+    ind[:] = np.split(store_ind[order], split)
+    dist[:] = np.split(2 * np.arcsin(np.sqrt(a[order])), split)
+    return ind, dist
+
+
+class KDTreeEngine:
+    """query() takes and returns the same things as BallTree(metric='haversine').query(),
+    plus an optional categories bitmask"""
+
+    CHUNK = 1 << 18  # max query x leaf box distances held in memory at once
+    # boxes are compared a little loosely so rounding can never prune the true answer
+    SLACK = 1e-9
+    ABS_SLACK = 1e-15
+
+    def __init__(self, stores_deg, kd_index, kd_lo, kd_hi, category_mask=None, kd_mask=None, category_names=None):
+        stores_rad = np.radians(np.asarray(stores_deg, dtype=np.float64))
+        valid = kd_index >= 0
+        safe = np.where(valid, kd_index, 0)
+        self.count = len(stores_rad)
+        self.category_names = category_names
+        self.leaf_index = safe.astype(np.intp)
+        self.leaf_lat = stores_rad[safe, 0]
+        self.leaf_lon = stores_rad[safe, 1]
+        self.leaf_cos = np.cos(self.leaf_lat)
+        self.lo = np.asarray(kd_lo)
+        self.hi = np.asarray(kd_hi)
+        if category_mask is None:
+            self.slot_mask = np.where(valid, ALL_CATEGORIES, 0).astype(np.uint32)
+            self.leaf_mask = np.full(len(self.lo), ALL_CATEGORIES, dtype=np.uint32)
+        else:
+            self.slot_mask = np.where(valid, np.asarray(category_mask)[safe], 0).astype(np.uint32)
+            self.leaf_mask = np.asarray(kd_mask)
+        self._filters = {}
+
+    @classmethod
+    def from_stores(cls, stores_deg, category_mask=None, category_names=None, leaf_size=LEAF_SIZE):
+        return cls(stores_deg, category_mask=category_mask, category_names=category_names,
+                   **build_kdtree(stores_deg, category_mask, leaf_size))
+
+    def _filter(self, categories):
+        """(leaves worth looking at, their boxes, a per slot penalty, matching store count) for a category mask.
+        Cached, so switching between targets only costs anything the first time."""
+        cached = self._filters.get(categories)
+        if cached is None:
+            leaves = np.flatnonzero(self.leaf_mask & categories)
+            # padding and stores of other categories are infinitely far away
+            slot_ok = (self.slot_mask[leaves] & categories) != 0
+            cached = (leaves, self.lo[leaves], self.hi[leaves], np.where(slot_ok, 0.0, np.inf), int(slot_ok.sum()))
+            self._filters[categories] = cached
+        return cached
+
+    def query(self, points_rad, k=1, categories=ALL_CATEGORIES):
+        points_rad = np.asarray(points_rad, dtype=np.float64).reshape(-1, 2)
+        leaves, lo, hi, pad, count = self._filter(int(categories))
+        if k > count:
+            raise ValueError(f"k={k} but there are only {count} stores in those categories")
+        dist = np.empty((len(points_rad), k))
+        ind = np.empty((len(points_rad), k), dtype=np.intp)
+        rows = max(1, self.CHUNK // len(leaves))
+        for start in range(0, len(points_rad), rows):
+            best_a, best_i = self._query_chunk(points_rad[start:start + rows], k, leaves, lo, hi, pad)
+            dist[start:start + rows] = 2 * np.arcsin(np.sqrt(best_a))
+            ind[start:start + rows] = best_i
+        return dist, ind
+
+    def query_radius(self, points_rad, r, return_distance=True, sort_results=True, categories=ALL_CATEGORIES):
+        """Every store within r radians of each point, like BallTree.query_radius (always sorted by distance)"""
+        points_rad = np.asarray(points_rad, dtype=np.float64).reshape(-1, 2)
+        leaves, lo, hi, pad, _ = self._filter(int(categories))
+        limit = np.sin(0.5 * r) ** 2  # r as a haversine "a" value
+        query_ind, store_ind, store_a = [], [], []
+        rows = max(1, self.CHUNK // max(1, len(leaves)))
+        for start in range(0, len(points_rad), rows):
+            chunk = points_rad[start:start + rows]
+            # every (query, leaf) pair whose box reaches inside the radius
+            pair_q, pair_leaf = np.nonzero(self._box_a(chunk, lo, hi) <= limit * (1 + self.SLACK) + self.ABS_SLACK)
+            a = self._leaf_a(chunk[pair_q], leaves[pair_leaf]) + pad[pair_leaf]
+            hit_pair, hit_slot = np.nonzero(a <= limit)
+            query_ind.append(pair_q[hit_pair] + start)
+            store_ind.append(self.leaf_index[leaves[pair_leaf[hit_pair]], hit_slot])
+            store_a.append(a[hit_pair, hit_slot])
+
+        ind, dist = group_by_query(len(points_rad), query_ind, store_ind, store_a)
+        return (ind, dist) if return_distance else ind
+
+    def _box_a(self, points_rad, lo, hi):
+        """Lower bound on the haversine "a" value from each point to anything in each box"""
+        q = unit_vectors(points_rad)[:, None, :]
+        # squared chord to the nearest corner/face of each box, /4 turns it into a haversine "a" value
+        gap = np.maximum(lo - q, 0) + np.maximum(q - hi, 0)
+        return np.einsum('ijk,ijk->ij', gap, gap) / 4
+
+    def _leaf_a(self, points_rad, leaf):
+        """Haversine "a" value from each point to every slot of its leaf.
+        Same formula and operation order as sklearn's haversine, so distances match bit for bit."""
+        lat = points_rad[:, :1]
+        lon = points_rad[:, 1:]
+        sin_0 = np.sin(0.5 * (lat - self.leaf_lat[leaf]))
+        sin_1 = np.sin(0.5 * (lon - self.leaf_lon[leaf]))
+        return sin_0 * sin_0 + np.cos(lat) * self.leaf_cos[leaf] * sin_1 * sin_1
+
+    def _query_chunk(self, points_rad, k, leaves, lo, hi, pad):
+        m = len(points_rad)
+        box_a = self._box_a(points_rad, lo, hi)
+        order = np.argsort(box_a, axis=1)
+
+        best_a = np.full((m, k), np.inf)
+        best_i = np.zeros((m, k), dtype=np.intp)
+        live = np.arange(m)
+        for rank in range(order.shape[1]):
+            leaf = order[live, rank]
+            keep = box_a[live, leaf] <= best_a[live, -1] * (1 + self.SLACK) + self.ABS_SLACK
+            live, leaf = live[keep], leaf[keep]
+            if not len(live):
+                break
+            slot_pad = pad[leaf]
+            leaf = leaves[leaf]
+            a = self._leaf_a(points_rad[live], leaf) + slot_pad
+
+            cand_a = np.concatenate((best_a[live], a), axis=1)
+            cand_i = np.concatenate((best_i[live], self.leaf_index[leaf]), axis=1)
+            part = np.argpartition(cand_a, k - 1, axis=1)[:, :k]
+            part_a = np.take_along_axis(cand_a, part, axis=1)
+            sort = np.argsort(part_a, axis=1, kind='stable')
+            best_a[live] = np.take_along_axis(part_a, sort, axis=1)
+            best_i[live] = np.take_along_axis(np.take_along_axis(cand_i, part, axis=1), sort, axis=1)
+        return best_a, best_i
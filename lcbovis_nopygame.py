@@ -1,44 +1,75 @@
 import math
-import numpy as np
-import serial
-import joblib
 import time
-import smbus2 as smbus
-#^CHANGE THIS TO JUST SMBUS WHEN ON RASPBERRY PI
-from PIL import Image, ImageFont, ImageDraw
 from adafruit_ssd1306 import SSD1306_I2C
-import pynmea2
 import board
-
-tree, store_locations_deg = joblib.load('tree.joblib')
-store_locations_rad = np.radians(store_locations_deg)
+from calibration import Calibration
+from deadreckoning import Predictor
+from geodesy import calculate_bearing, get_local_declination
+from gps import GPSReader
+from headingfilter import make_filter
+from instrument import Instruments
+from magnetometer import HMC5883L
+from nearest import NearestCache, StoreIndex
+from oled import PartialDisplay
+from pipeline import compass_pipeline
+from redraw import RedrawPolicy
+from framebuf import FrameBuffer
+from sprites import direct_arrow_tip, draw_direct, numpy_atlas
+from storeindex import load_stores_or_joblib
+
+# nearest store search: 'kdtree' or 'brute' (numpy only), 'balltree' (the sklearn tree in the joblib file)
+INDEX_ENGINE = 'kdtree'
+tree, store_locations_deg = load_stores_or_joblib('stores.index', 'tree.joblib', INDEX_ENGINE)
+# which kind of store to point at, any categories from stores.index (see tree.py), can be changed while running
+TARGET = 'lcbo'
+stores = StoreIndex(tree, store_locations_deg)
+nearest_cache = NearestCache(stores)  # skips the tree while we're still closest to the same store
+# WMM declination grid from stores.index (see declination.py), the old toronto/kingston guess without one
+local_declination = tree.declination.at if getattr(tree, 'declination', None) else get_local_declination
 
 #placeholder values
 your_lat = 43.66739785769686
 your_lon = -79.38122281349305
 heading = 90
 
+# each of these runs at its own rate (see pipeline.py)
+GPS_HZ = 5  # the NEO-6M can do up to 5 fixes a second
+COMPASS_HZ = 15  # HMC5883L output rate
+# heading smoothing (see headingfilter.py): 'smooth', 'mean' or 'none', and how far behind it may run
+HEADING_FILTER = 'smooth'
+HEADING_LATENCY_S = 0.2
+FPS = 10
+IDLE_FPS = 1  # when nothing on screen changed for a while (see redraw.py)
+# carry the position forward between fixes along the gps speed and course (see deadreckoning.py),
+# then it's worth reading the position as often as we draw
+PREDICT_POSITION = True
+POSITION_HZ = FPS if PREDICT_POSITION else GPS_HZ
+# fake magnetometer and GPS walking data/route.csv (see simulate.py), to try everything without the modules
+SIMULATE_SENSORS = False
+# time the sensor reads, store search, bearing and drawing (see instrument.py), off costs nothing
+INSTRUMENT = False
+INSTRUMENT_FILE = None  # timings appended here as JSON lines every 10 s, printed if None
+
 # --- Compass Functions ---
 
-def read_word(addr):
-    ADDRESS = 0x1E
-    bus = smbus.SMBus(1)
-    bus.write_byte_data(ADDRESS, 0x00, 0x70)  # 8 samples, 15Hz
-    bus.write_byte_data(ADDRESS, 0x01, 0x20)  # Gain = 1.3 gauss 
-    bus.write_byte_data(ADDRESS, 0x02, 0x00)  # Continuous mode(doesn't sleep after taking one measurement)
-    high = bus.read_byte_data(ADDRESS, addr)
-    low = bus.read_byte_data(ADDRESS, addr + 1)
-    val = (high << 8) + low
-    if val > 32767:
-        val -= 65536
-    return val
+compass = None  # HMC5883L, opened the first time get_heading() is called
+calibration = Calibration.load()  # hard/soft iron correction from python calibration.py, none if it hasn't been run
 
 def get_heading():
-    x = read_word(0x03)
-    y = read_word(0x07)
-    
+    global compass
+    if compass is None:
+        bus = None
+        if SIMULATE_SENSORS:
+            from simulate import FakeSMBus  # only when simulating, the real hardware never needs it
+            bus = FakeSMBus()
+        compass = HMC5883L(bus)  # opens i2c bus 1 and configures the chip once
+    sample = compass.read()
+    if sample is None:  # no new sample in time, keep pointing the same way
+        return heading
+    x, y, _ = calibration.apply(*sample)
+
     heading_rad = math.atan2(y, x)
-    heading_rad += get_local_declination(your_lat, your_lon)
+    heading_rad += local_declination(your_lat, your_lon)
 
     if heading_rad < 0:
         heading_rad += 2 * math.pi
@@ -47,62 +78,35 @@ def get_heading():
 
     return heading_rad * 180 / math.pi
 
-def get_local_declination(lat, lon):
-    toronto = (43.7, -79.4)
-    kingston = (44.2, -76.5)
-    dist_to_toronto = haversine(lat, lon, *toronto)
-    dist_to_kingston = haversine(lat, lon, *kingston)
+# --- GPS Functions ---
+def find_closest_store(lat_deg, lon_deg, categories=None):
+    # cached single point lookup, use stores.query directly for whole tracks
+    ind, distance_m, _ = nearest_cache.lookup(lat_deg, lon_deg, TARGET if categories is None else categories)
+    return store_locations_deg[ind], distance_m
 
-    declination_toronto = 0.1972222
-    declination_kingston = 0.244346
+def find_k_closest(lat_deg, lon_deg, k=5, categories=None):
+    """The k nearest stores, closest first, as (indices, distances in m, bearings) arrays"""
+    ind, distance_m, bearing = stores.k_closest((lat_deg, lon_deg), k, TARGET if categories is None else categories)
+    return ind[0], distance_m[0], bearing[0]
 
-    return declination_toronto if dist_to_toronto <= dist_to_kingston else declination_kingston
+def find_within_radius(lat_deg, lon_deg, radius_m=2000, categories=None):
+    """Every store within radius_m, closest first, as (indices, distances in m, bearings) arrays"""
+    _, ind, distance_m, bearing = stores.within_radius((lat_deg, lon_deg), radius_m, TARGET if categories is None else categories)
+    return ind, distance_m, bearing
 
-# --- GPS Functions ---
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000  # earth radius in meters
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-
-    a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-def calculate_bearing(lat1, lon1, lat2, lon2):
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_lambda = math.radians(lon2 - lon1)
-
-    x = math.sin(delta_lambda) * math.cos(phi2)
-    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(delta_lambda)
-
-    bearing = (math.degrees(math.atan2(x, y)) + 360) % 360
-    return bearing
-
-def find_closest_store(lat_deg, lon_deg):
-    point_rad = np.radians([[lat_deg, lon_deg]])
-    dist, ind = tree.query(point_rad, k=1)
-    closest_index = ind[0][0]
-    distance_m = dist[0][0] * 6371000
-    return store_locations_deg[closest_index], distance_m
+gps = None  # GPSReader, started the first time get_gps_coords() is called
 
 def get_gps_coords():
-    """Fetches GPS coordinates once from the serial port"""
-    port = "/dev/ttyAMA0"
-    try:
-        with serial.Serial(port, baudrate=9600, timeout=0.5) as ser:
-            data = ser.readline()
-            if data.startswith(b'$GPRMC'):
-                msg = pynmea2.parse(data.decode('ascii'))
-                if hasattr(msg, 'latitude') and hasattr(msg, 'longitude'):
-                    return msg.latitude, msg.longitude
-            return None  # No valid GPS data found
-    
-    except (serial.SerialException, pynmea2.ParseError, UnicodeDecodeError) as e:
-        print(f"GPS error: {e}")
-        return None
+    """Latest GPS position from the background reader, None until there's a valid fix. Never waits."""
+    global gps
+    if gps is None:
+        # keeps the port open and reads every sentence on its own thread
+        port = "/dev/ttyAMA0"
+        if SIMULATE_SENSORS:
+            from simulate import NMEAEmitter, Route
+            port = NMEAEmitter(Route.load()).start().port
+        gps = GPSReader(port, predictor=Predictor() if PREDICT_POSITION else None).start()
+    return gps.position()
 #^UNCOMMENT WHEN USING MODULES ON RASPI
 
 # --- Display Functions ---
@@ -112,49 +116,80 @@ def init_display():
     disp.show()
     disp.clear()
     disp.display()
-    return disp
+    return PartialDisplay(disp)  # only sends the parts of each frame that changed
+
+# 'atlas': arrow snapped to 128 directions, a frame is a copy and a few ORs of pieces drawn at startup
+# 'direct': everything drawn with numpy every frame, arrow at the exact angle to the pixel
+RENDER = 'atlas'
+ATLAS = numpy_atlas()
+fb = FrameBuffer()  # 1024 bytes in the screen's own layout, reused every frame
 
 def draw_compass(disp, current_heading_deg, target_bearing_deg, distance_to_store):
-    image = Image.new("1", (128, 64))
-    draw = ImageDraw.Draw(image)
-    
-    #draw compass circle
-    draw.ellipse((96-25, 32-25, 96+25, 32+25), outline=1, width=1)
-    
-    #draw arrow
-    turn_angle = (target_bearing_deg - current_heading_deg) % 360
-    turn_rad = math.radians(turn_angle)
-    arrow_x = 96 + math.sin(turn_rad) * 25
-    arrow_y = 32 - math.cos(turn_rad) * 25
-    draw.line((96, 32, arrow_x, arrow_y), fill=1, width=2)
-    
-    #distance in meters
-    font = ImageFont.load_default()
-    draw.text((5, 24), f"{int(distance_to_store)}m", font=font, fill=1)
-    disp.image(image)
-    disp.display()
+    if RENDER == 'direct':
+        disp.show(draw_direct(fb, current_heading_deg, target_bearing_deg, distance_to_store))
+    else:
+        disp.show(ATLAS.compose(current_heading_deg, target_bearing_deg, distance_to_store, out=fb.pages))
 
 # --- Main Loop ---
+def read_heading():
+    global heading
+    # heading = get_heading()  # Uncomment for real compass
+    if SIMULATE_SENSORS:
+        heading = get_heading()
+    return heading
+
+def read_position():
+    global your_lat, your_lon
+    # your_lat, your_lon = get_gps_coords() or (your_lat, your_lon)  # Uncomment for real GPS
+    if SIMULATE_SENSORS:
+        your_lat, your_lon = get_gps_coords() or (your_lat, your_lon)
+    return your_lat, your_lon
+
 def main():
-    global heading, your_lat, your_lon
     #initialize screen
     disp = init_display()
+    #sensors and the store search run on their own threads, this loop only draws
+    instruments = Instruments(INSTRUMENT, INSTRUMENT_FILE).start()
+    timed = instruments.wrap  # hands the function back untouched when INSTRUMENT is off
+    heading_filter = make_filter(HEADING_FILTER, HEADING_LATENCY_S, COMPASS_HZ)
+    pipeline, headings, targets = compass_pipeline(timed('read_heading', read_heading), timed('read_position', read_position),
+                                                   timed('find_closest_store', find_closest_store), POSITION_HZ,
+                                                   COMPASS_HZ, heading_filter.update, current_target=lambda: TARGET)
+    bearing_between = timed('calculate_bearing', calculate_bearing)
+    draw = timed('draw_compass', draw_compass)
+    pipeline.start()
+    # only draws frames that look different, the arrow snapped the same way the renderer snaps it
+    redraw = RedrawPolicy(direct_arrow_tip if RENDER == 'direct' else ATLAS.arrow_index, FPS, IDLE_FPS)
     try:
+        next_frame = time.monotonic()
         while True:
-            #sensor data
-            # heading = get_heading()  # Uncomment for real compass
-            # your_lat, your_lon = get_gps_coords()  # Uncomment for real GPS
-            
-            (store_lat, store_lon), distance = find_closest_store(your_lat, your_lon)
-            bearing = calculate_bearing(your_lat, your_lon, store_lat, store_lon)
-            
-            draw_compass(disp, heading, bearing, distance)
-            time.sleep(0.1) 
+            target = targets.latest()
+            if target is not None:  # nothing to point at before the first position
+                (lat, lon), (store_lat, store_lon), distance = target
+                bearing = bearing_between(lat, lon, store_lat, store_lon)
+                current_heading = headings.latest(heading)
+                if redraw.should_draw(current_heading, bearing, distance):
+                    draw(disp, current_heading, bearing, distance)
+                    instruments.count('frames_drawn')
+                else:
+                    instruments.count('frames_skipped')
+            next_frame = max(next_frame + 1 / redraw.current_fps(), time.monotonic())
+            time.sleep(max(0, next_frame - time.monotonic()))
             
     except KeyboardInterrupt:
+        pipeline.stop()
+        instruments.stop()
         disp.clear()
-        disp.display()
-        print("\nExiting cleanly")
+        print(f"\nnearest store cache: {nearest_cache.stats()}")
+        print(f"redraw: {redraw.stats()}")
+        print(f"display: {disp.stats()}")
+        print(f"pipeline: {pipeline.stats()}")
+        if compass is not None:
+            print(f"magnetometer: {compass.stats()}")
+        if gps is not None:
+            gps.stop()
+            print(f"gps: {gps.stats()}")
+        print("Exiting cleanly")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
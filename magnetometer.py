@@ -0,0 +1,148 @@
+"""HMC5883L driver that opens the I2C bus and configures the chip once.
+
+The old read_word() opened the bus and rewrote all three config registers on every call, and
+get_heading() called it twice plus four single byte reads, so 8+ transactions per heading.
+Here a sample is one status read (polling RDY so the same sample is never read twice) and one
+6 byte block read of X, Z, Y. Polling only starts once the next sample is due, so on a steady
+clock that's about 2 transactions per sample.
+
+    python magnetometer.py [seconds] [trace.csv]   -> reads the chip for a while and prints samples/s,
+                                                     saving every sample if given a file (see read_trace)
+"""
+import math
+import sys
+import time
+
+ADDRESS = 0x1E
+
+# registers
+CONFIG_A = 0x00
+CONFIG_B = 0x01
+MODE = 0x02
+DATA = 0x03  # X MSB, X LSB, Z MSB, Z LSB, Y MSB, Y LSB (that order)
+STATUS = 0x09
+STATUS_RDY = 0x01
+
+CONTINUOUS = 0x00
+OVERFLOW = -4096  # what an axis reads when the field is out of range for the gain
+
+# output rate in Hz -> config A bits 4:2, averaged samples -> bits 6:5
+RATES_HZ = {0.75: 0, 1.5: 1, 3: 2, 7.5: 3, 15: 4, 30: 5, 75: 6}
+AVERAGING = {1: 0, 2: 1, 4: 2, 8: 3}
+# gain in gauss -> config B bits 7:5, and counts per gauss at that gain
+GAINS = {0.88: (0, 1370), 1.3: (1, 1090), 1.9: (2, 820), 2.5: (3, 660), 4.0: (4, 440), 4.7: (5, 390),
+         5.6: (6, 330), 8.1: (7, 230)}
+
+
+def open_bus(busnum=1):
+    # smbus2 off the pi, the smbus that comes with raspbian on it
+    try:
+        import smbus2 as smbus
+    except ImportError:
+        import smbus
+    return smbus.SMBus(busnum)
+
+
+def read_trace(path):
+    """(t, x, y, z) rows of a trace the command line saved, t in seconds from the start and raw counts"""
+    with open(path) as f:
+        next(f)  # header
+        return [tuple(float(v) for v in line.split(',')) for line in f if line.strip()]
+
+
+def _signed(high, low):
+    val = (high << 8) | low
+    return val - 65536 if val > 32767 else val
+
+
+class HMC5883L:
+    """One chip on an already open bus (anything with the smbus read/write methods), or on i2c bus 1"""
+
+    POLL_FRACTION = 0.05  # once a sample is due, poll RDY every this much of a sample period
+
+    def __init__(self, bus=None, address=ADDRESS, rate_hz=15, averaging=8, gain=1.3):
+        self.bus = open_bus() if bus is None else bus
+        self.address = address
+        self.period = 1 / rate_hz
+        self.counts_per_gauss = GAINS[gain][1]
+        self.samples = 0
+        self.transactions = 0
+        self.overflows = 0
+        self._due = 0.0
+        self._started = time.monotonic()
+
+        self._write(CONFIG_A, AVERAGING[averaging] << 5 | RATES_HZ[rate_hz] << 2)
+        self._write(CONFIG_B, GAINS[gain][0] << 5)
+        self._write(MODE, CONTINUOUS)
+
+    def _write(self, register, value):
+        self.transactions += 1
+        self.bus.write_byte_data(self.address, register, value)
+
+    def ready(self):
+        """True if there's a sample we haven't read yet"""
+        self.transactions += 1
+        return bool(self.bus.read_byte_data(self.address, STATUS) & STATUS_RDY)
+
+    def _read_sample(self):
+        self.transactions += 1
+        data = self.bus.read_i2c_block_data(self.address, DATA, 6)
+        self.samples += 1
+        self._due = time.monotonic() + self.period
+        x, z, y = _signed(data[0], data[1]), _signed(data[2], data[3]), _signed(data[4], data[5])
+        if OVERFLOW in (x, y, z):
+            self.overflows += 1
+            return None
+        return x, y, z
+
+    def poll(self):
+        """(x, y, z) in raw counts if a new sample is ready, None otherwise (or if it overflowed).
+        Doesn't touch the bus before the next sample is due, so it's fine to call this in a fast loop."""
+        if time.monotonic() < self._due or not self.ready():
+            return None
+        return self._read_sample()
+
+    def read(self, timeout=1.0):
+        """Waits for the next new sample, (x, y, z) in raw counts or None after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if now >= self._due and self.ready():
+                sample = self._read_sample()
+                if sample is not None:
+                    return sample
+            elif now >= deadline:
+                return None
+            else:
+                time.sleep(max(self._due - now, self.period * self.POLL_FRACTION))
+
+    def gauss(self, sample):
+        """Raw counts to gauss"""
+        return tuple(v / self.counts_per_gauss for v in sample)
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started
+        return {'samples': self.samples, 'overflows': self.overflows,
+                'samples_per_s': self.samples / elapsed if elapsed else 0.0,
+                'transactions_per_sample': self.transactions / self.samples if self.samples else 0.0}
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    trace = open(sys.argv[2], 'w') if len(sys.argv) > 2 else None
+    if trace:
+        trace.write("t,x,y,z\n")
+    chip = HMC5883L(rate_hz=75, averaging=1)
+    start = time.monotonic()
+    end = start + seconds
+    while time.monotonic() < end:
+        sample = chip.read()
+        if sample is not None:
+            x, y, z = sample
+            print(f"\r{math.degrees(math.atan2(y, x)) % 360:6.1f} deg", end='')
+            if trace:
+                trace.write(f"{time.monotonic() - start:.4f},{x},{y},{z}\n")
+    print()
+    if trace:
+        trace.close()
+    print(chip.stats())
@@ -0,0 +1,139 @@
+import numpy as np
+
+from geodesy import EARTH_RADIUS_M, calculate_bearing, haversine
+
+
+class StoreIndex:
+    """Batch nearest-store lookups on top of the tree saved by tree.py"""
+
+    def __init__(self, tree, store_locations_deg):
+        self.tree = tree
+        self.store_locations_deg = np.asarray(store_locations_deg, dtype=np.float64)
+        self.store_locations_rad = np.radians(self.store_locations_deg)
+        self.grids = getattr(tree, 'grids', {})  # precomputed by tree.py, see grid.py
+        names = getattr(tree, 'category_names', None)
+        self._any_mask = (1 << len(names)) - 1 if names else None
+
+    def category_mask(self, categories):
+        """Bitmask for a category name, a list of them, or an int mask (passed through).
+        None means any store, and so does anything for a tree without categories (an old joblib
+        file only has one kind of store in it anyway)."""
+        names = getattr(self.tree, 'category_names', None)
+        if categories is None or names is None:
+            return None
+        if isinstance(categories, (int, np.integer)):
+            return int(categories)
+        if isinstance(categories, str):
+            categories = (categories,)
+        mask = 0
+        for category in categories:
+            if category not in names:
+                raise ValueError(f"unknown category {category!r}, this index has {', '.join(names)}")
+            mask |= 1 << names.index(category)
+        return mask
+
+    def grid_nearest(self, lat_deg, lon_deg, categories=None):
+        """(nearest store index, meters it stays the nearest) straight from the precomputed grid,
+        (-1, 0.0) if there's no grid for these categories or this spot needs the tree"""
+        mask = self.category_mask(categories)
+        grid = self.grids.get(self._any_mask if mask is None else mask)
+        return (-1, 0.0) if grid is None else grid.nearest(lat_deg, lon_deg)
+
+    def _tree_kwargs(self, categories):
+        # BallTree doesn't know about categories, so only pass them when there's something to filter
+        mask = self.category_mask(categories)
+        return {} if mask is None else {'categories': mask}
+
+    def _bearings(self, points_deg, ind):
+        store_deg = self.store_locations_deg[ind]
+        lat = points_deg[:, 0].reshape((-1,) + (1,) * (ind.ndim - 1))
+        lon = points_deg[:, 1].reshape(lat.shape)
+        return calculate_bearing(lat, lon, store_deg[..., 0], store_deg[..., 1])
+
+    def query(self, positions_deg, categories=None):
+        """Nearest store for every (lat, lon) row of an (N, 2) array in degrees, optionally only
+        stores in the given categories (see category_mask()).
+        Returns (indices, distances in meters, bearings in degrees), one entry per row."""
+        ind, distance_m, bearing = self.k_closest(positions_deg, 1, categories)
+        return ind[:, 0], distance_m[:, 0], bearing[:, 0]
+
+    def k_closest(self, positions_deg, k, categories=None):
+        """The k nearest stores for every row, closest first.
+        Returns (indices, distances in meters, bearings in degrees), each (N, k)."""
+        points_deg = np.asarray(positions_deg, dtype=np.float64).reshape(-1, 2)
+        dist, ind = self.tree.query(np.radians(points_deg), k=k, **self._tree_kwargs(categories))
+        return ind, dist * EARTH_RADIUS_M, self._bearings(points_deg, ind)
+
+    def within_radius(self, positions_deg, radius_m, categories=None):
+        """Every store within radius_m of every row, closest first, all rows packed one after another.
+        Returns (offsets, indices, distances in meters, bearings in degrees): row i's stores are
+        indices[offsets[i]:offsets[i + 1]] and so on, so offsets has N + 1 entries."""
+        points_deg = np.asarray(positions_deg, dtype=np.float64).reshape(-1, 2)
+        ind, dist = self.tree.query_radius(np.radians(points_deg), radius_m / EARTH_RADIUS_M, return_distance=True,
+                                           sort_results=True, **self._tree_kwargs(categories))
+        offsets = np.zeros(len(points_deg) + 1, dtype=np.intp)
+        np.cumsum([len(i) for i in ind], out=offsets[1:])
+        ind = np.concatenate(ind).astype(np.intp) if len(ind) else np.empty(0, dtype=np.intp)
+        dist = np.concatenate(dist) if len(dist) else np.empty(0)
+        row = np.repeat(np.arange(len(points_deg)), np.diff(offsets))
+        return offsets, ind, dist * EARTH_RADIUS_M, self._bearings(points_deg[row], ind)
+
+    def query_chunks(self, chunks, categories=None):
+        """Same as query() but for an iterator of (N, 2) chunks, e.g. a GPS track read in pieces.
+        Yields one (indices, distances, bearings) tuple per chunk so the whole track never has to be in memory."""
+        for chunk in chunks:
+            yield self.query(chunk, categories)
+
+
+class NearestCache:
+    """Remembers the last nearest store plus how much closer it was than the runner-up.
+    Moving less than half that gap can't make any other store the closest one (triangle inequality),
+    so until the user walks that far the tree isn't asked again, only the distance and bearing to
+    the cached store are recomputed. Misses go to the precomputed grid first and the tree last."""
+
+    MARGIN_M = 0.001  # keeps float rounding from ever calling a borderline position safe
+
+    def __init__(self, stores):
+        self.stores = stores
+        self.hits = 0
+        self.misses = 0
+        self.grid_hits = 0
+        self._mask = self._lat = self._lon = None
+        self._ind = self._store_lat = self._store_lon = None
+        self._safe_m = -1.0
+
+    def lookup(self, lat_deg, lon_deg, categories=None):
+        """(store index, distance in meters, bearing in degrees) of the nearest store"""
+        mask = self.stores.category_mask(categories)
+        if (self._ind is not None and mask == self._mask
+                and haversine(lat_deg, lon_deg, self._lat, self._lon) < self._safe_m):
+            self.hits += 1
+            return (self._ind, haversine(lat_deg, lon_deg, self._store_lat, self._store_lon),
+                    calculate_bearing(lat_deg, lon_deg, self._store_lat, self._store_lon))
+
+        self.misses += 1
+        ind, safe_m = self.stores.grid_nearest(lat_deg, lon_deg, categories)
+        if ind >= 0:
+            self.grid_hits += 1
+            self._remember(mask, lat_deg, lon_deg, ind, safe_m - self.MARGIN_M)
+            return (ind, haversine(lat_deg, lon_deg, self._store_lat, self._store_lon),
+                    calculate_bearing(lat_deg, lon_deg, self._store_lat, self._store_lon))
+
+        try:
+            ind, distance_m, bearing = self.stores.k_closest((lat_deg, lon_deg), 2, categories)
+            safe_m = (distance_m[0, 1] - distance_m[0, 0]) / 2 - self.MARGIN_M
+        except ValueError:  # only one store to choose from, it's always the answer
+            ind, distance_m, bearing = self.stores.k_closest((lat_deg, lon_deg), 1, categories)
+            safe_m = float('inf')
+        self._remember(mask, lat_deg, lon_deg, int(ind[0, 0]), safe_m)
+        return self._ind, float(distance_m[0, 0]), float(bearing[0, 0])
+
+    def _remember(self, mask, lat_deg, lon_deg, ind, safe_m):
+        self._mask, self._lat, self._lon = mask, float(lat_deg), float(lon_deg)
+        self._ind, self._safe_m = ind, safe_m
+        self._store_lat, self._store_lon = (float(x) for x in self.stores.store_locations_deg[ind])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'grid_hits': self.grid_hits,
+                'tree_queries': self.misses - self.grid_hits, 'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,104 @@
+"""NMEA parser that works straight on the bytes from the serial port, no pynmea2.
+
+Only the two sentences the compass needs: RMC (position, validity, speed, course) and GGA (position,
+fix quality, HDOP), from any talker, so $GPRMC as well as $GNRMC/$GNGGA from multi-constellation
+receivers. Fields are split as bytes and float()/int() read them directly, nothing gets decoded
+into str and no message objects get built. Lines with a bad or missing checksum are dropped.
+"""
+from collections import namedtuple
+
+KNOTS = 0.514444  # m/s
+RMC, GGA = 'RMC', 'GGA'
+
+# lat/lon are None without a fix, valid is RMC's A/V flag or GGA's quality > 0,
+# speed/course are None in GGA and quality/hdop None in RMC. utc is the fix's hhmmss.ss field as
+# it came (bytes, None if empty), only ever compared, so RMC and GGA of the same fix can be told apart
+Sentence = namedtuple('Sentence', 'kind lat lon valid speed_mps course_deg quality hdop utc')
+
+_HEX = {b'%02X' % i: i for i in range(256)}
+_HEX.update({b'%02x' % i: i for i in range(256)})
+
+
+def checksum(body):
+    """XOR of every byte, folded down a wide int instead of looping over the bytes in python"""
+    n = len(body)
+    x = int.from_bytes(body, 'little')
+    while n > 1:
+        half = (n + 1) // 2
+        x = (x & ((1 << 8 * half) - 1)) ^ (x >> 8 * half)
+        n = half
+    return x
+
+
+def _degrees(value, hemisphere):
+    # ddmm.mmmm / dddmm.mmmm
+    v = float(value)
+    deg = int(v // 100)
+    deg += (v - deg * 100) / 60
+    return -deg if hemisphere in (b'S', b'W') else deg
+
+
+def parse(line):
+    """Sentence from one raw line (bytes or memoryview, with or without the line ending),
+    None if it's not RMC/GGA or it's broken"""
+    line = bytes(line).rstrip(b'\r\n')
+    star = len(line) - 3
+    if len(line) < 10 or line[0] != 0x24 or line[star] != 0x2A:  # '$', '*'
+        return None
+    kind = line[3:6]  # after the two letter talker
+    if kind != b'RMC' and kind != b'GGA':  # most of the stream, skip those before the checksum
+        return None
+    if checksum(line[1:star]) != _HEX.get(line[star + 1:]):
+        return None
+
+    fields = line[6:star].split(b',')  # fields[0] is the empty bit before the first comma
+    try:
+        utc = fields[1] or None
+        if kind == b'RMC':
+            # time, status, lat, N/S, lon, E/W, speed (knots), course, date, ...
+            valid = fields[2] == b'A'
+            if not valid or not fields[3] or not fields[5]:
+                return Sentence(RMC, None, None, False, None, None, None, None, utc)
+            return Sentence(RMC, _degrees(fields[3], fields[4]), _degrees(fields[5], fields[6]), True,
+                            float(fields[7]) * KNOTS if fields[7] else 0.0,
+                            float(fields[8]) if fields[8] else None, None, None, utc)
+        if kind == b'GGA':
+            # time, lat, N/S, lon, E/W, quality, satellites, hdop, altitude, ...
+            quality = int(fields[6]) if fields[6] else 0
+            hdop = float(fields[8]) if fields[8] else None
+            if not quality or not fields[2] or not fields[4]:
+                return Sentence(GGA, None, None, False, None, None, quality, hdop, utc)
+            return Sentence(GGA, _degrees(fields[2], fields[3]), _degrees(fields[4], fields[5]), True,
+                            None, None, quality, hdop, utc)
+    except (IndexError, ValueError):
+        return None
+    return None
+
+
+def sentence(body):
+    """Adds the $, checksum and line ending to a sentence body like b'GPRMC,...'"""
+    return b'$%s*%02X\r\n' % (body, checksum(body))
+
+
+def _ddmm(value, width, positive, negative):
+    hemisphere = positive if value >= 0 else negative
+    value = abs(value)
+    deg = int(value)
+    minutes = round((value - deg) * 60, 4)
+    if minutes >= 60:
+        deg, minutes = deg + 1, minutes - 60
+    return b'%0*d%07.4f,%s' % (width, deg, minutes, hemisphere)
+
+
+def rmc_sentence(lat, lon, speed_mps=0.0, course_deg=0.0, utc_s=0.0, talker=b'GP'):
+    """A valid RMC line, for simulated receivers and test logs"""
+    h, m, s = int(utc_s // 3600) % 24, int(utc_s // 60) % 60, utc_s % 60
+    return sentence(b'%sRMC,%02d%02d%05.2f,A,%s,%s,%.2f,%.1f,010126,,,A' % (
+        talker, h, m, s, _ddmm(lat, 2, b'N', b'S'), _ddmm(lon, 3, b'E', b'W'), speed_mps / KNOTS, course_deg))
+
+
+def gga_sentence(lat, lon, quality=1, satellites=8, hdop=1.0, utc_s=0.0, talker=b'GP'):
+    """A GGA line to go with rmc_sentence"""
+    h, m, s = int(utc_s // 3600) % 24, int(utc_s // 60) % 60, utc_s % 60
+    return sentence(b'%sGGA,%02d%02d%05.2f,%s,%s,%d,%02d,%.1f,100.0,M,-35.0,M,,' % (
+        talker, h, m, s, _ddmm(lat, 2, b'N', b'S'), _ddmm(lon, 3, b'E', b'W'), quality, satellites, hdop))
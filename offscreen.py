@@ -0,0 +1,79 @@
+"""Low resolution pygame rendering for the HDMI front-ends.
+
+lcbovisual/boozevisual used to fill and flip the whole native resolution screen every tick to show
+a 128x64 compass. Here the compass is drawn into a small offscreen surface, and only the parts that
+changed since the last frame get scaled up onto the screen and pushed with display.update(rects),
+so a frame costs about the same at 1080p as on a tiny screen.
+"""
+import numpy as np
+import pygame
+
+BAND = 8  # rows compared together when looking for what changed
+
+
+class ScaledDisplay:
+    """Draw into .surface (size pixels), then present(). The frame is scaled by the biggest whole
+    number that fits the screen and centered on it."""
+
+    def __init__(self, screen, size=(128, 64), scale=None):
+        self.screen = screen
+        self.surface = pygame.Surface(size).convert(screen)
+        width, height = size
+        screen_w, screen_h = screen.get_size()
+        self.scale = scale or max(1, min(screen_w // width, screen_h // height))
+        self.origin = ((screen_w - width * self.scale) // 2, (screen_h - height * self.scale) // 2)
+        self._shown = None  # last presented frame's pixels
+        self.frames = 0
+        self.skipped = 0
+        self.pixels_pushed = 0
+
+    def _to_screen(self, rect):
+        x, y, w, h = rect
+        s = self.scale
+        return pygame.Rect(self.origin[0] + x * s, self.origin[1] + y * s, w * s, h * s)
+
+    def _changed_rects(self, pixels):
+        """Rects (in surface pixels) around everything that differs from the last frame, one per band
+        of rows, neighbouring bands merged when their columns overlap"""
+        changed = pixels != self._shown
+        rects = []
+        for top in range(0, changed.shape[1], BAND):
+            cols = np.flatnonzero(changed[:, top:top + BAND].any(axis=1))
+            if not len(cols):
+                continue
+            rect = pygame.Rect(int(cols[0]), top, int(cols[-1]) - int(cols[0]) + 1, min(BAND, changed.shape[1] - top))
+            if rects and rects[-1].bottom == top and rects[-1].left <= rect.right and rect.left <= rects[-1].right:
+                rects[-1].union_ip(rect)
+            else:
+                rects.append(rect)
+        return rects
+
+    def present(self):
+        """Scales the changed parts onto the screen and updates only those, nothing if nothing changed"""
+        self.frames += 1
+        pixels = pygame.surfarray.array2d(self.surface)
+        if self._shown is None:  # first frame, the whole screen
+            self.screen.fill((0, 0, 0))
+            full = self._to_screen(self.surface.get_rect())
+            pygame.transform.scale(self.surface, full.size, self.screen.subsurface(full))
+            pygame.display.flip()
+            self.pixels_pushed += self.screen.get_width() * self.screen.get_height()
+            self._shown = pixels
+            return
+        rects = self._changed_rects(pixels)
+        if not rects:
+            self.skipped += 1
+            return
+        updated = []
+        for rect in rects:
+            target = self._to_screen(rect)
+            pygame.transform.scale(self.surface.subsurface(rect), target.size, self.screen.subsurface(target))
+            updated.append(target)
+            self.pixels_pushed += target.w * target.h
+        pygame.display.update(updated)
+        self._shown = pixels
+
+    def stats(self):
+        sent = self.frames - self.skipped
+        return {'frames': self.frames, 'skipped': self.skipped, 'scale': self.scale,
+                'pixels_per_frame': self.pixels_pushed / sent if sent else 0.0}
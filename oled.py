@@ -0,0 +1,92 @@
+"""SSD1306 updates that only send the parts of the screen that changed.
+
+disp.image(image); disp.display() pushes all 1024 bytes of the framebuffer (plus a command per
+byte of addressing) every frame, at 400 kHz that's ~25 ms of a bus the magnetometer shares.
+PartialDisplay keeps what's on the screen now, compares the new frame page by page (a page is
+8 pixel rows, one byte per column) and only sends the changed column span of each changed page,
+merging neighbouring pages when one bigger write is cheaper. An unchanged frame sends nothing.
+"""
+import numpy as np
+
+WIDTH, HEIGHT = 128, 64
+
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+COMMANDS = 0x00  # control byte: the rest of the write is commands
+DATA = 0x40  # control byte: the rest of the write is display data
+ADDRESSING_BYTES = 7  # control + column range + page range, in one write
+FULL_FRAME_BYTES = 6 * 2 + 1 + WIDTH * HEIGHT // 8  # what adafruit's show() sends
+
+
+def image_to_pages(image):
+    """(pages, width) uint8 in SSD1306 layout from a mode "1" PIL image, bit 0 of a byte being the top row"""
+    pixels = np.asarray(image, dtype=bool)
+    height, width = pixels.shape
+    return np.packbits(pixels.reshape(height // 8, 8, width), axis=1, bitorder='little').reshape(height // 8, width)
+
+
+class PartialDisplay:
+    """Wraps an adafruit SSD1306_I2C. The chip has to be in horizontal addressing mode (the driver sets that)."""
+
+    def __init__(self, disp, width=WIDTH, height=HEIGHT, write=None):
+        self.disp = disp
+        self.width = width
+        self.pages = height // 8
+        self.write = write or self._i2c_write  # write(bytes) sends one I2C write to the display
+        self.shown = None  # what's on the screen, unknown until the first frame
+        self.frames = 0
+        self.skipped = 0
+        self.bytes_sent = 0
+
+    def _i2c_write(self, data):
+        with self.disp.i2c_device as device:
+            device.write(data)
+
+    def show_image(self, image):
+        self.show(image_to_pages(image))
+
+    def clear(self):
+        self.show(np.zeros((self.pages, self.width), dtype=np.uint8))
+
+    def show(self, pages):
+        """Sends whatever differs between pages ((pages, width) uint8) and the screen"""
+        self.frames += 1
+        if self.shown is None:
+            spans = [(0, self.pages - 1, 0, self.width - 1)]
+        else:
+            spans = self._changed_spans(pages)
+            if not spans:
+                self.skipped += 1
+                return
+        for page0, page1, col0, col1 in spans:
+            self.write(bytes((COMMANDS, SET_COL_ADDR, col0, col1, SET_PAGE_ADDR, page0, page1)))
+            data = bytes((DATA,)) + pages[page0:page1 + 1, col0:col1 + 1].tobytes()
+            self.write(data)
+            self.bytes_sent += ADDRESSING_BYTES + len(data)
+        self.shown = pages.copy()
+
+    def _changed_spans(self, pages):
+        """(first page, last page, first column, last column) rectangles covering every changed byte"""
+        changed = pages != self.shown
+        dirty = np.flatnonzero(changed.any(axis=1))
+        spans = []
+        for page in dirty:
+            cols = np.flatnonzero(changed[page])
+            span = (page, page, int(cols[0]), int(cols[-1]))
+            if spans and spans[-1][1] == page - 1:
+                # one write over both pages with the union of their columns, if that sends fewer bytes
+                p0, p1, c0, c1 = spans[-1]
+                u0, u1 = min(c0, span[2]), max(c1, span[3])
+                merged = (page - p0 + 1) * (u1 - u0 + 1)
+                separate = (p1 - p0 + 1) * (c1 - c0 + 1) + (span[3] - span[2] + 1) + ADDRESSING_BYTES + 1
+                if merged <= separate:
+                    spans[-1] = (p0, page, u0, u1)
+                    continue
+            spans.append(span)
+        return [(int(p0), int(p1), c0, c1) for p0, p1, c0, c1 in spans]
+
+    def stats(self):
+        sent = self.frames - self.skipped
+        return {'frames': self.frames, 'skipped': self.skipped,
+                'bytes_per_frame': self.bytes_sent / self.frames if self.frames else 0.0,
+                'bytes_per_sent_frame': self.bytes_sent / sent if sent else 0.0}
@@ -0,0 +1,145 @@
+"""Sensor -> compute -> render stages that each run at their own rate.
+
+The front-ends used to do everything in one loop (read sensors, find the store, draw, sleep 0.1 s),
+so the slowest step set the pace for all of them. Here the GPS runs at its fix rate, the
+magnetometer at its output rate and the nearest store search only when the position changes,
+each on its own thread, and they hand their latest value on through small bounded channels.
+The render loop stays on the main thread (pygame wants that) and just picks up the newest values.
+"""
+import threading
+import time
+from collections import deque
+
+
+class Channel:
+    """Bounded hand-off between stages. put() never blocks, a full channel drops its oldest value
+    (a consumer only ever cares about the newest position or heading anyway)."""
+
+    def __init__(self, size=1):
+        self._items = deque(maxlen=size)
+        self._ready = threading.Condition()
+        self._latest = None
+        self.puts = 0
+        self.dropped = 0
+
+    def put(self, value):
+        with self._ready:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(value)
+            self._latest = value
+            self.puts += 1
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Oldest value not taken yet, waits up to timeout seconds for one (None if nothing came)"""
+        with self._ready:
+            if not self._items and not self._ready.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def latest(self, default=None):
+        """Newest value ever put, without waiting or taking it. Safe to call from a render loop."""
+        value = self._latest
+        return default if value is None else value
+
+
+class Stage(threading.Thread):
+    """Calls fn at rate_hz (or as fast as fn returns, for fns that wait on hardware themselves) and puts
+    what it returns into sink. With a source it instead calls fn(value) for every value that comes in.
+    None results aren't passed on, and with changed_only neither are repeats of the last one."""
+
+    def __init__(self, name, fn, sink=None, rate_hz=None, source=None, changed_only=False):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.sink = sink
+        self.period = 1 / rate_hz if rate_hz else 0.0
+        self.source = source
+        self.changed_only = changed_only
+        self.runs = 0
+        self.busy_s = 0.0
+        self._last = None
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self):
+        next_run = time.monotonic()
+        while not self._stopping.is_set():
+            if self.source is not None:
+                value = self.source.get(timeout=0.5)
+                if value is None:
+                    continue
+                start = time.monotonic()
+                out = self.fn(value)
+            else:
+                start = time.monotonic()
+                out = self.fn()
+            self.runs += 1
+            self.busy_s += time.monotonic() - start
+            if out is not None and self.sink is not None and not (self.changed_only and out == self._last):
+                self._last = out
+                self.sink.put(out)
+
+            if self.period:
+                # fixed schedule, but don't try to catch up after a slow call
+                next_run = max(next_run + self.period, time.monotonic())
+                self._stopping.wait(next_run - time.monotonic())
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = stages
+        self._started = None
+
+    def start(self):
+        self._started = time.monotonic()
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join(timeout=1)
+
+    def stats(self):
+        """Runs per second and time spent per run for every stage"""
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        return {stage.name: {'hz': round(stage.runs / elapsed, 1) if elapsed else 0.0,
+                             'ms_per_run': round(stage.busy_s / stage.runs * 1e3, 3) if stage.runs else 0.0}
+                for stage in self.stages}
+
+
+def compass_pipeline(read_heading, read_position, find_closest_store, gps_hz=5, compass_hz=15, filter_heading=None,
+                     current_target=lambda: None):
+    """The stages every front-end runs: heading, position and the nearest store for each new position.
+    filter_heading (headingfilter.py's update) gets every raw heading on its own stage if given.
+    current_target() is read along with every position and handed to find_closest_store as its
+    categories, so switching targets finds the new store even while standing still.
+    Returns (pipeline, headings, targets), targets carrying ((lat, lon), (store_lat, store_lon), distance_m)."""
+    headings = Channel()
+    positions = Channel()
+    targets = Channel()
+    # a few raw headings of slack so the filter doesn't miss samples if it gets scheduled late
+    raw_headings = Channel(size=8) if filter_heading is not None else headings
+
+    def located():
+        position = read_position()
+        return None if position is None else (position, current_target())
+
+    def nearest(located):
+        position, target = located
+        store, distance_m = find_closest_store(*position, target)
+        return position, (float(store[0]), float(store[1])), distance_m
+
+    pipeline = Pipeline([
+        Stage('compass', read_heading, raw_headings, rate_hz=compass_hz),
+        Stage('gps', located, positions, rate_hz=gps_hz, changed_only=True),  # a new target counts as a change
+        Stage('nearest', nearest, targets, source=positions),
+    ])
+    if filter_heading is not None:
+        pipeline.stages.insert(1, Stage('heading filter', filter_heading, headings, source=raw_headings))
+    return pipeline, headings, targets
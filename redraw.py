@@ -0,0 +1,50 @@
+"""Only draw a frame when it would look different, and slow the loop down when nothing moves.
+
+A frame shows two things: the arrow, which the atlas snaps to one of its angles anyway (and draw_direct
+to the pixel its tip lands on, sprites.direct_arrow_tip), and the distance as a whole number of meters. If neither changed the frame would be the same pixels, so it
+isn't drawn. After IDLE_AFTER_S without a change the loop drops from its normal rate to IDLE_FPS,
+and goes back up as soon as something changes.
+"""
+import time
+
+IDLE_FPS = 1
+IDLE_AFTER_S = 5.0
+
+
+class RedrawPolicy:
+    """arrow_index(heading, bearing) is whatever the renderer snaps the arrow to (sprites.Atlas.arrow_index)"""
+
+    def __init__(self, arrow_index, fps=10, idle_fps=IDLE_FPS, idle_after_s=IDLE_AFTER_S):
+        self.arrow_index = arrow_index
+        self.fps = fps
+        self.idle_fps = idle_fps
+        self.idle_after_s = idle_after_s
+        self.rendered = 0
+        self.skipped = 0
+        self.wakeups = 0
+        self._shown = None
+        self._started = self._last_change = time.monotonic()
+
+    def should_draw(self, current_heading_deg, target_bearing_deg, distance_to_store):
+        """Call once per loop, True if the frame has to be drawn"""
+        self.wakeups += 1
+        shown = (self.arrow_index(current_heading_deg, target_bearing_deg), int(distance_to_store))
+        if shown == self._shown:
+            self.skipped += 1
+            return False
+        self._shown = shown
+        self._last_change = time.monotonic()
+        self.rendered += 1
+        return True
+
+    def idle(self):
+        return time.monotonic() - self._last_change > self.idle_after_s
+
+    def current_fps(self):
+        """How often the loop should wake up right now"""
+        return self.idle_fps if self.idle() else self.fps
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started
+        return {'rendered': self.rendered, 'skipped': self.skipped, 'idle': self.idle(),
+                'wakeups_per_s': round(self.wakeups / elapsed, 2) if elapsed else 0.0}
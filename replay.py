@@ -0,0 +1,213 @@
+"""Runs recorded sensor data through everything the compass does, off the device and faster than real time.
+
+    python replay.py [--nmea data/track.nmea] [--mag data/compass.csv] [--index stores.index] [--json out.json]
+
+A NMEA log (cat /dev/ttyAMA0 > data/track.nmea) and a magnetometer trace (python magnetometer.py 600
+data/compass.csv) get merged on one simulated clock: NMEA lines carry no time so every RMC starts
+the next fix (--gps-hz apart), trace samples have theirs. Missing files are simulated the same way
+bench.py does. Frames come at FPS of simulated time, and each one goes through what the front-ends
+do: GPS parse (+ position prediction), heading (calibration, atan2, declination) and its filter,
+nearest store, bearing, the redraw check, rendering into a FrameBuffer and the partial display
+update, with the display's I2C writes going nowhere. None of the front-ends get imported, so
+there's no pygame, board or serial needed.
+
+Prints calls/s of busy time and per call latency for every stage, and how much faster than real
+time the whole replay ran.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+import geodesy
+from calibration import CALIBRATION_FILE, Calibration
+from deadreckoning import Predictor
+from framebuf import FrameBuffer
+from gps import GPSReader
+from headingfilter import make_filter
+from magnetometer import read_trace
+from nearest import NearestCache, StoreIndex
+from oled import PartialDisplay
+from redraw import RedrawPolicy
+from sprites import direct_arrow_tip, draw_direct, numpy_atlas
+from storeindex import load_stores
+
+STAGES = ('gps', 'heading', 'filter', 'position', 'nearest', 'bearing', 'redraw', 'render', 'display')
+
+
+class StageTimes:
+    """Every call's duration for each stage, in ns"""
+
+    def __init__(self):
+        self.ns = {stage: [] for stage in STAGES + ('frame',)}
+
+    def report(self):
+        rows = {}
+        for stage, samples in self.ns.items():
+            if not samples:
+                continue
+            ns = np.array(samples, dtype=np.float64)
+            rows[stage] = {'calls': len(ns), 'calls_per_s': round(len(ns) / (ns.sum() / 1e9)),
+                           'mean_us': round(ns.mean() / 1e3, 2), 'p50_us': round(np.percentile(ns, 50) / 1e3, 2),
+                           'p99_us': round(np.percentile(ns, 99) / 1e3, 2), 'max_us': round(ns.max() / 1e3, 2)}
+        return rows
+
+
+def nmea_timeline(lines, gps_hz=1.0):
+    """(time, line) for every line of a log, every RMC starting the next fix"""
+    t = -1 / gps_hz
+    timeline = []
+    for line in lines:
+        if line[3:6] == b'RMC':
+            t += 1 / gps_hz
+        timeline.append((max(t, 0.0), line))
+    return timeline
+
+
+def load_inputs(nmea_path, mag_path, seconds):
+    """(nmea lines, trace rows) from the files, simulated (see bench.py) for any that aren't there"""
+    if os.path.exists(nmea_path):
+        with open(nmea_path, 'rb') as f:
+            lines = [line for line in f if line.strip()]
+    else:
+        from bench import nmea_corpus
+        print(f"{nmea_path} not found, simulating a receiver", file=sys.stderr)
+        lines = nmea_corpus(int(seconds))
+    if os.path.exists(mag_path):
+        trace = read_trace(mag_path)
+    else:
+        from bench import mag_trace
+        print(f"{mag_path} not found, simulating a magnetometer", file=sys.stderr)
+        trace = mag_trace(int(seconds))[0].tolist()
+    return lines, trace
+
+
+def replay(lines, trace, index='stores.index', target='lcbo', fps=10, gps_hz=1.0, render='atlas',
+           heading_filter='smooth', latency_s=0.2, predict=True):
+    """Runs the whole thing, returns (stage timings, summary)"""
+    tree, stores_deg = load_stores(index)
+    stores = StoreIndex(tree, stores_deg)
+    cache = NearestCache(stores)
+    declination = tree.declination.at if tree.declination is not None else geodesy.get_local_declination
+    calibration = Calibration.load(CALIBRATION_FILE)
+    compass_hz = (len(trace) - 1) / (trace[-1][0] - trace[0][0]) if len(trace) > 1 else 15
+    smoother = make_filter(heading_filter, latency_s, compass_hz)
+    gps = GPSReader(predictor=Predictor() if predict else None)
+    atlas = numpy_atlas()
+    fb = FrameBuffer()
+    display = PartialDisplay(None, write=lambda data: None)  # counts what it would send, sends nothing
+    redraw = RedrawPolicy(direct_arrow_tip if render == 'direct' else atlas.arrow_index, fps)
+    times = StageTimes()
+    ns = times.ns
+    clock = time.perf_counter_ns
+
+    timeline = nmea_timeline(lines, gps_hz)
+    t0 = trace[0][0] if trace else 0.0
+    end_s = min(timeline[-1][0] if timeline else 0.0, trace[-1][0] - t0 if trace else 0.0)
+    n_line = n_sample = 0
+    lat = lon = None
+    heading = 0.0
+    frames = 0
+    started = time.perf_counter()
+    for frame in range(int(end_s * fps) + 1):
+        now = frame / fps
+
+        # everything the sensors sent since the last frame
+        while n_line < len(timeline) and timeline[n_line][0] <= now:
+            start = clock()
+            gps.feed(timeline[n_line][1], now=timeline[n_line][0])
+            ns['gps'].append(clock() - start)
+            n_line += 1
+        while n_sample < len(trace) and trace[n_sample][0] - t0 <= now:
+            _, x, y, z = trace[n_sample]
+            start = clock()
+            x, y, _ = calibration.apply(x, y, z)
+            heading_rad = math.atan2(y, x)
+            if lat is not None:  # no declination before the first fix, same as the front-ends' placeholder
+                heading_rad += declination(lat, lon)
+            raw = math.degrees(heading_rad) % 360
+            ns['heading'].append(clock() - start)
+            start = clock()
+            heading = smoother.update(raw)
+            ns['filter'].append(clock() - start)
+            n_sample += 1
+
+        frame_start = start = clock()
+        position = gps.position(now=now)
+        ns['position'].append(clock() - start)
+        if position is None:
+            continue
+        lat, lon = position
+        start = clock()
+        ind, distance, _ = cache.lookup(lat, lon, target)
+        ns['nearest'].append(clock() - start)
+        store_lat, store_lon = stores_deg[ind]
+        start = clock()
+        bearing = geodesy.calculate_bearing(lat, lon, float(store_lat), float(store_lon))
+        ns['bearing'].append(clock() - start)
+        start = clock()
+        changed = redraw.should_draw(heading, bearing, distance)
+        ns['redraw'].append(clock() - start)
+        if changed:
+            start = clock()
+            if render == 'direct':
+                pages = draw_direct(fb, heading, bearing, distance)
+            else:
+                pages = atlas.compose(heading, bearing, distance, out=fb.pages)
+            ns['render'].append(clock() - start)
+            start = clock()
+            display.show(pages)
+            ns['display'].append(clock() - start)
+        ns['frame'].append(clock() - frame_start)
+        frames += 1
+    wall_s = time.perf_counter() - started
+
+    summary = {'simulated_s': round(end_s, 1), 'wall_s': round(wall_s, 3),
+               'x_real_time': round(end_s / wall_s, 1) if wall_s else 0.0, 'frames': frames,
+               'nmea_lines': n_line, 'mag_samples': n_sample,
+               'redraw': {'rendered': redraw.rendered, 'skipped': redraw.skipped},  # its wake-ups/s are wall clock
+               'display': display.stats(), 'nearest_cache': cache.stats(),
+               'gps': gps.stats()}
+    return times, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded GPS/magnetometer data through the compass pipeline")
+    parser.add_argument('--nmea', default='data/track.nmea', help="NMEA log, simulated if it doesn't exist")
+    parser.add_argument('--mag', default='data/compass.csv', help="magnetometer trace, simulated if it doesn't exist")
+    parser.add_argument('--seconds', type=float, default=600, help="how much to simulate when there's no log")
+    parser.add_argument('--index', default='stores.index')
+    parser.add_argument('--target', default='lcbo', help="store categories to point at, ';' separated")
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--gps-hz', type=float, default=1.0, help="fixes per second in the NMEA log")
+    parser.add_argument('--render', choices=('atlas', 'direct'), default='atlas')
+    parser.add_argument('--filter', choices=('smooth', 'mean', 'none'), default='smooth')
+    parser.add_argument('--no-predict', action='store_true', help="hold the last fix instead of predicting")
+    parser.add_argument('--json', help="also write the results here")
+    args = parser.parse_args()
+
+    lines, trace = load_inputs(args.nmea, args.mag, args.seconds)
+    target = tuple(args.target.split(';')) if ';' in args.target else args.target
+    times, summary = replay(lines, trace, args.index, target, args.fps, args.gps_hz, args.render, args.filter,
+                            predict=not args.no_predict)
+    stages = times.report()
+
+    print(f"replayed {summary['simulated_s']}s in {summary['wall_s']}s, {summary['x_real_time']}x real time, "
+          f"{summary['frames']} frames")
+    print(f"{'stage':>10} {'calls':>8} {'calls/s':>10} {'mean':>9} {'p50':>9} {'p99':>9} {'max':>9}")
+    for stage, row in stages.items():
+        print(f"{stage:>10} {row['calls']:>8} {row['calls_per_s']:>10} {row['mean_us']:>7.2f}us "
+              f"{row['p50_us']:>7.2f}us {row['p99_us']:>7.2f}us {row['max_us']:>7.2f}us")
+    for key in ('redraw', 'display', 'nearest_cache', 'gps'):
+        print(f"{key}: {summary[key]}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'stages': stages}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
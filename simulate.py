@@ -0,0 +1,295 @@
+"""Software stand-ins for the GPS serial port and the HMC5883L, for running and load testing without the hardware.
+
+NMEAEmitter opens a pseudo terminal and writes what a NEO-6M would into it while walking a route
+(a csv of lat,lon[,speed_mps] waypoints, the speed being for the leg that starts there), paced like
+a 9600 baud UART, so GPSReader(emitter.port) reads it exactly like /dev/ttyAMA0. FakeSMBus answers
+the smbus calls magnetometer.py makes with an HMC5883L's registers behind them: config and mode
+registers, samples coming at the configured output rate with RDY set until they're read, the gain
+deciding the counts (and overflow), noise, and every transaction holding the bus for as long as it
+would at 400 kHz. Other addresses take writes too (the OLED), so bus sharing shows up as waiting.
+
+    python simulate.py gps [data/route.csv]   -> prints a pty to point GPSReader (or anything) at
+    python simulate.py bench [seconds]         -> both readers and an OLED on the fakes, with their stats
+"""
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import nmea
+from geodesy import calculate_bearing, haversine
+from magnetometer import ADDRESS, CONFIG_A, CONFIG_B, CONTINUOUS, DATA, GAINS, MODE, OVERFLOW, RATES_HZ, STATUS, \
+    STATUS_RDY
+
+ROUTE_FILE = 'data/route.csv'
+WALK_MPS = 1.4
+I2C_HZ = 400000
+BITS_PER_BYTE = 9  # 8 bits and an ack
+
+# HMC5883L registers after power up: 15 Hz, gain 1.3, single measurement mode, 'H43' id
+HMC5883L_RESET = bytes((0x10, 0x20, 0x01, 0, 0, 0, 0, 0, 0, 0, ord('H'), ord('4'), ord('3')))
+IDLE_MODE = 0x03
+
+
+class Route:
+    """Walks a list of (lat, lon, speed_mps) waypoints at their speeds, around again after the last one"""
+
+    def __init__(self, waypoints, loop=True):
+        self.points = np.asarray(waypoints, dtype=np.float64)
+        lat, lon, speed = self.points.T
+        legs = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        self.courses = np.atleast_1d(calculate_bearing(lat[:-1], lon[:-1], lat[1:], lon[1:]))
+        self.speeds = speed[:-1]
+        self.arrivals = np.concatenate(([0.0], np.cumsum(legs / self.speeds)))  # seconds to each waypoint
+        self.loop = loop
+
+    @classmethod
+    def load(cls, path=ROUTE_FILE):
+        with open(path) as f:
+            next(f)
+            rows = [[float(v) for v in line.split(',')] for line in f if line.strip()]
+        return cls([row + [WALK_MPS] * (3 - len(row)) for row in rows])
+
+    def at(self, t):
+        """(lat, lon, speed_mps, course_deg) t seconds after setting off"""
+        total = self.arrivals[-1]
+        t = t % total if self.loop else min(t, total)
+        leg = min(int(np.searchsorted(self.arrivals, t, side='right')) - 1, len(self.speeds) - 1)
+        f = (t - self.arrivals[leg]) / (self.arrivals[leg + 1] - self.arrivals[leg])
+        (lat0, lon0), (lat1, lon1) = self.points[leg, :2], self.points[leg + 1, :2]
+        return lat0 + f * (lat1 - lat0), lon0 + f * (lon1 - lon0), float(self.speeds[leg]), float(self.courses[leg])
+
+
+class NMEAEmitter:
+    """A fake receiver on a pseudo terminal, .port is the device to open"""
+
+    def __init__(self, route, hz=1.0, baudrate=9600, noise_m=2.0, seed=0):
+        self.route = route
+        self.period = 1 / hz
+        self.byte_s = 10 / baudrate  # start + 8 data + stop bits
+        self.noise_deg = noise_m / 111320
+        self.rng = np.random.default_rng(seed)
+        import tty  # POSIX only, imported here so FakeSMBus still works anywhere
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)  # no echo, no newline translation, like a real serial port
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self.sentences = 0
+        self.bytes = 0
+        self.dropped = 0  # lines nobody read in time (the pty's buffer was full), a UART overrun
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='nmea emitter', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def burst(self, t):
+        """The lines one fix sends, the same ones bench.nmea_corpus uses"""
+        lat, lon, speed, course = self.route.at(t)
+        lat, lon = (lat, lon) + self.rng.normal(0, self.noise_deg, 2)
+        utc_s = 43200 + t
+        return [nmea.rmc_sentence(lat, lon, speed, course, utc_s),
+                nmea.sentence(b'GPVTG,%.1f,T,,M,%.3f,N,%.3f,K,A' % (course, speed / nmea.KNOTS, speed * 3.6)),
+                nmea.gga_sentence(lat, lon, 1, 8, 1.1, utc_s),
+                nmea.sentence(b'GPGSA,A,3,10,07,05,02,29,04,08,13,,,,,1.72,1.03,1.38'),
+                nmea.sentence(b'GPGSV,3,1,11,10,63,137,17,07,61,098,15,05,59,290,20,08,54,157,30')]
+
+    def _run(self):
+        start = time.monotonic()
+        fix = 0
+        while not self._stop.is_set():
+            for line in self.burst(fix * self.period):
+                try:
+                    os.write(self._master, line)
+                except BlockingIOError:
+                    self.dropped += 1
+                    continue
+                self.sentences += 1
+                self.bytes += len(line)
+                self._stop.wait(len(line) * self.byte_s)  # the wire only goes so fast
+            fix += 1
+            self._stop.wait(start + fix * self.period - time.monotonic())
+
+    def stats(self):
+        return {'sentences': self.sentences, 'bytes': self.bytes, 'dropped': self.dropped}
+
+
+class FakeSMBus:
+    """smbus2.SMBus lookalike with an HMC5883L at ADDRESS. heading(t) is where the device points
+    (degrees, t in seconds), field the horizontal and vertical field in gauss, offset a hard iron
+    offset in counts to give calibration.py something to do."""
+
+    def __init__(self, heading=None, field=(0.18, 0.5), offset=(0, 0, 0), noise_counts=2.0, i2c_hz=I2C_HZ,
+                 timed=True, seed=0):
+        self.heading = heading or (lambda t: (90 + 10 * t) % 360)
+        self.field = field
+        self.offset = offset
+        self.noise_counts = noise_counts
+        self.bit_s = 1 / i2c_hz
+        self.timed = timed
+        self.rng = np.random.default_rng(seed)
+        self.registers = bytearray(HMC5883L_RESET)
+        self._started = time.monotonic()
+        self._measuring_since = None
+        self._read_sample = -1  # number of the last sample whose data registers were read
+        self._bus = threading.Lock()
+        self.transactions = 0
+        self.busy_s = 0.0
+        self.wait_s = 0.0
+        self.other_writes = 0
+
+    # --- the bus ---
+
+    def _transaction(self, n_bytes):
+        """Holds the bus as long as n_bytes (plus address and register bytes) take on the wire"""
+        asked = time.perf_counter()
+        self._bus.acquire()
+        got = time.perf_counter()
+        self.wait_s += got - asked
+        duration = (n_bytes + 2) * BITS_PER_BYTE * self.bit_s
+        if self.timed:
+            while time.perf_counter() - got < duration:  # sleep() can't do tens of microseconds
+                pass
+        self.busy_s += duration
+        self.transactions += 1
+        self._bus.release()
+
+    def _check(self, address):
+        if address != ADDRESS:
+            raise OSError(121, "Remote I/O error")  # what smbus says when nothing answers
+
+    def write_byte_data(self, address, register, value):
+        self._check(address)
+        self._transaction(1)
+        self.registers[register] = value
+        if register == MODE:
+            self._measuring_since = time.monotonic() if value & IDLE_MODE == CONTINUOUS else None
+            self._read_sample = -1
+
+    def write_i2c_block_data(self, address, register, data):
+        """Any other chip on the bus (the OLED), only takes up bus time"""
+        self._transaction(1 + len(data))
+        if address != ADDRESS:
+            self.other_writes += 1
+            return
+        for i, value in enumerate(data):
+            self.registers[register + i] = value
+
+    def read_byte_data(self, address, register):
+        self._check(address)
+        self._transaction(1)
+        if register == STATUS:
+            return STATUS_RDY if self._latest_sample() > self._read_sample else 0
+        return self.registers[register]
+
+    def read_i2c_block_data(self, address, register, length):
+        self._check(address)
+        self._transaction(length)
+        if register == DATA:
+            sample = self._latest_sample()
+            if sample >= 0:
+                self._fill_data(sample)
+                self._read_sample = sample
+        return list(self.registers[register:register + length])
+
+    def close(self):
+        pass
+
+    # --- the chip ---
+
+    def _period(self):
+        rate_bits = self.registers[CONFIG_A] >> 2 & 0x07
+        return 1 / next((hz for hz, bits in RATES_HZ.items() if bits == rate_bits), 15)
+
+    def _latest_sample(self):
+        """Number of the newest finished measurement since continuous mode started, -1 if none"""
+        if self._measuring_since is None:
+            return -1
+        return int((time.monotonic() - self._measuring_since) / self._period()) - 1
+
+    def _fill_data(self, sample):
+        t = self._measuring_since + (sample + 1) * self._period() - self._started
+        gain_bits = self.registers[CONFIG_B] >> 5
+        counts_per_gauss = next(counts for bits, counts in GAINS.values() if bits == gain_bits)
+        heading = math.radians(self.heading(t))
+        horizontal, vertical = self.field
+        gauss = (horizontal * math.cos(heading), horizontal * math.sin(heading), -vertical)
+        x, y, z = (round(g * counts_per_gauss + o + self.rng.normal(0, self.noise_counts))
+                   for g, o in zip(gauss, self.offset))
+        x, y, z = (v if -2048 <= v <= 2047 else OVERFLOW for v in (x, y, z))
+        for i, value in enumerate((x, z, y)):  # the chip's register order
+            self.registers[DATA + 2 * i:DATA + 2 * i + 2] = (value & 0xFFFF).to_bytes(2, 'big')
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started
+        return {'transactions': self.transactions, 'other_writes': self.other_writes,
+                'bus_busy': round(self.busy_s / elapsed, 4) if elapsed else 0.0,
+                'wait_ms_per_transaction': round(self.wait_s / self.transactions * 1e3, 4) if self.transactions else 0.0}
+
+
+def bench(seconds=10.0):
+    """Runs the real readers against the fakes for a while, an OLED sharing the magnetometer's bus"""
+    from gps import GPSReader
+    from magnetometer import HMC5883L
+    from oled import PartialDisplay
+    from sprites import numpy_atlas
+
+    emitter = NMEAEmitter(Route.load(), hz=5).start()
+    gps = GPSReader(emitter.port).start()
+    bus = FakeSMBus()
+    compass = HMC5883L(bus, rate_hz=75, averaging=1)
+    display = PartialDisplay(None, write=lambda data: bus.write_i2c_block_data(0x3C, data[0], list(data[1:])))
+    atlas = numpy_atlas()
+    stop = threading.Event()
+
+    def draw():
+        frame = 0
+        while not stop.is_set():
+            display.show(atlas.compose(frame * 7 % 360, 0, 100 + frame % 50))
+            frame += 1
+            stop.wait(0.1)
+
+    drawing = threading.Thread(target=draw, daemon=True)
+    drawing.start()
+    end = time.monotonic() + seconds
+    headings = 0
+    while time.monotonic() < end:
+        if compass.read() is not None:
+            headings += 1
+    stop.set()
+    drawing.join()
+    gps.stop()
+    emitter.stop()
+    print(f"simulated devices for {seconds:g}s")
+    print(f"magnetometer: {compass.stats()}")
+    print(f"i2c bus: {bus.stats()}")
+    print(f"display: {display.stats()}")
+    print(f"nmea emitter: {emitter.stats()}")
+    print(f"gps reader: {gps.stats()}, last fix {gps.position()}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['gps']:
+        emitter = NMEAEmitter(Route.load(sys.argv[2] if len(sys.argv) > 2 else ROUTE_FILE)).start()
+        print(f"fake GPS on {emitter.port}, ctrl-c to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            emitter.stop()
+    elif sys.argv[1:2] == ['bench']:
+        bench(float(sys.argv[2]) if len(sys.argv) > 2 else 10.0)
+    else:
+        sys.exit("usage: python simulate.py gps [route.csv] | bench [seconds]")
@@ -0,0 +1,194 @@
+"""Pre-rendered compass pieces, so drawing a frame is a copy and a few ORs instead of trig and rasterising.
+
+Everything is packed 1 bit per pixel in SSD1306 page layout ((pages, columns) uint8, bit 0 = top row
+of the page), the same thing oled.PartialDisplay sends. The dial is a whole frame, the arrow is drawn
+once for each of ANGLES directions inside the dial's box, and the characters of the distance text are
+drawn once at the text's row. Each back-end builds its atlas with its own drawing code (numpy_atlas,
+pil_atlas, pygame_atlas) so the frames look the same as when everything was drawn every frame, and pygame
+gets the pieces as surfaces (SurfaceAtlas) since blitting those beats unpacking bits.
+"""
+import math
+
+import numpy as np
+
+from framebuf import FrameBuffer, font_masks
+
+WIDTH, HEIGHT = 128, 64
+CENTER = (96, 32)
+RADIUS = 25
+TEXT_POS = (5, 24)
+ANGLES = 128  # arrow directions, 2.8 degrees apart moves the tip about a pixel
+CHARS = '0123456789m'
+
+
+def pack(mask):
+    """(height, width) bool pixels to (height // 8, width) page bytes"""
+    height, width = mask.shape
+    return np.packbits(mask.reshape(height // 8, 8, width), axis=1, bitorder='little').reshape(height // 8, width)
+
+
+def unpack(pages):
+    """Back to (height, width) pixels, 0 or 1 (what an 8 bit black/white surface wants)"""
+    n_pages, width = pages.shape
+    return np.unpackbits(pages[:, None, :], axis=1, bitorder='little').reshape(n_pages * 8, width)
+
+
+def arrow_tip(turn_deg, center=CENTER, radius=RADIUS):
+    turn_rad = math.radians(turn_deg)
+    return center[0] + math.sin(turn_rad) * radius, center[1] - math.cos(turn_rad) * radius
+
+
+class Atlas:
+    """draw_dial() and draw_arrow(turn_deg) return (HEIGHT, WIDTH) bool masks of the whole screen,
+    glyphs maps each of CHARS to a (rows, advance) bool mask whose top row lands on TEXT_POS's y"""
+
+    def __init__(self, draw_dial, draw_arrow, glyphs, angles=ANGLES, text_pos=TEXT_POS):
+        self.angles = angles
+        self.dial = pack(draw_dial())
+
+        # every arrow fits in the dial's box (plus a pixel for the line width), only keep that part
+        arrows = [pack(draw_arrow(i * 360 / angles)) for i in range(angles)]
+        cols = np.flatnonzero(np.bitwise_or.reduce([a.any(axis=0) for a in arrows + [self.dial]]))
+        self.arrow_cols = slice(int(cols[0]), int(cols[-1]) + 1)
+        self.arrows = np.stack([a[:, self.arrow_cols] for a in arrows])
+
+        # glyphs drawn at the text's y, so the page bits already line up and x can be anything
+        x, y = text_pos
+        self.text_x = x
+        self.glyphs = {}
+        for char, mask in glyphs.items():
+            rows = np.zeros((HEIGHT, mask.shape[1]), dtype=bool)
+            rows[y:y + mask.shape[0]] = mask[:HEIGHT - y]
+            used = np.flatnonzero(pack(rows).any(axis=1))  # only the pages the glyph has pixels in
+            page0, page1 = (int(used[0]), int(used[-1]) + 1) if len(used) else (0, 0)
+            self.glyphs[char] = pack(rows)[page0:page1], slice(page0, page1)
+
+    def arrow_index(self, current_heading_deg, target_bearing_deg):
+        turn = (target_bearing_deg - current_heading_deg) % 360
+        return round(turn * self.angles / 360) % self.angles
+
+    def compose(self, current_heading_deg, target_bearing_deg, distance_to_store, out=None):
+        """The whole frame as (pages, WIDTH) uint8, into out if given (no allocations then)"""
+        if out is None:
+            out = np.empty_like(self.dial)
+        out[:] = self.dial
+        out[:, self.arrow_cols] |= self.arrows[self.arrow_index(current_heading_deg, target_bearing_deg)]
+
+        x = self.text_x
+        for char in f"{int(distance_to_store)}m":
+            glyph, pages = self.glyphs[char]
+            width = min(glyph.shape[1], WIDTH - x)
+            if width <= 0:
+                break
+            out[pages, x:x + width] |= glyph[:, :width]
+            x += glyph.shape[1]
+        return out
+
+
+class SurfaceAtlas:
+    """The same pieces turned into pygame surfaces once, for pygame a frame is then a few blits
+    (that's cheaper than unpacking the bits into a surface every frame)"""
+
+    def __init__(self, atlas):
+        import pygame
+        self.atlas = atlas
+
+        def surface(pages, transparent=True):
+            pixels = unpack(pages).T
+            s = pygame.Surface(pixels.shape, depth=8)
+            s.set_palette([(0, 0, 0), (255, 255, 255)])
+            pygame.surfarray.blit_array(s, pixels)
+            if transparent:
+                s.set_colorkey(0)
+            return s
+
+        self.dial = surface(atlas.dial, transparent=False)
+        self.arrows = [surface(arrow) for arrow in atlas.arrows]
+        self.arrow_x = atlas.arrow_cols.start
+        self.glyphs = {char: (surface(glyph), pages.start * 8) for char, (glyph, pages) in atlas.glyphs.items()}
+
+    def convert(self):
+        """Converts every surface to the display's pixel format, call after set_mode"""
+        self.dial = self.dial.convert()
+        self.arrows = [arrow.convert() for arrow in self.arrows]
+        self.glyphs = {char: (glyph.convert(), y) for char, (glyph, y) in self.glyphs.items()}
+        return self
+
+    def compose(self, target, current_heading_deg, target_bearing_deg, distance_to_store, pos=(0, 0)):
+        """Blits the frame onto target with its top left corner at pos"""
+        left, top = pos
+        target.blit(self.dial, pos)
+        target.blit(self.arrows[self.atlas.arrow_index(current_heading_deg, target_bearing_deg)],
+                    (left + self.arrow_x, top))
+        x = left + self.atlas.text_x
+        for char in f"{int(distance_to_store)}m":
+            glyph, y = self.glyphs[char]
+            target.blit(glyph, (x, top + y))
+            x += glyph.get_width()
+
+
+def direct_arrow_tip(current_heading_deg, target_bearing_deg):
+    """The pixel draw_direct's arrow ends on, what Atlas.arrow_index is for the atlas: same tip, same pixels"""
+    x, y = arrow_tip((target_bearing_deg - current_heading_deg) % 360)
+    return round(x), round(y)
+
+
+def draw_direct(fb, current_heading_deg, target_bearing_deg, distance_to_store):
+    """The frame drawn from scratch into a framebuf.FrameBuffer, arrow at the exact angle (to the pixel its
+    tip lands on). No atlas needed."""
+    fb.clear()
+    fb.circle(*CENTER, RADIUS)
+    fb.line(*CENTER, *direct_arrow_tip(current_heading_deg, target_bearing_deg), width=2)
+    fb.text(f"{int(distance_to_store)}m", *TEXT_POS)
+    return fb.pages
+
+
+def numpy_atlas(angles=ANGLES):
+    """Atlas drawn with framebuf's numpy primitives and 5x7 font, needs neither PIL nor pygame"""
+    fb = FrameBuffer()
+
+    def draw(fn):
+        fb.clear()
+        fn()
+        return unpack(fb.pages).astype(bool)
+
+    return Atlas(lambda: draw(lambda: fb.circle(*CENTER, RADIUS)),
+                 lambda turn: draw(lambda: fb.line(*CENTER, *arrow_tip(turn), width=2)),
+                 font_masks(), angles)
+
+
+def pil_atlas(font=None, angles=ANGLES):
+    """Atlas drawn with the same PIL calls lcbovis_nopygame used to make every frame"""
+    from PIL import Image, ImageDraw, ImageFont
+    font = font or ImageFont.load_default()
+
+    def draw(fn):
+        image = Image.new("1", (WIDTH, HEIGHT))
+        fn(ImageDraw.Draw(image))
+        return np.asarray(image, dtype=bool)
+
+    cx, cy = CENTER
+    glyphs = {}
+    for char in CHARS:
+        image = Image.new("1", (math.ceil(font.getlength(char)), HEIGHT - TEXT_POS[1]))
+        ImageDraw.Draw(image).text((0, 0), char, font=font, fill=1)
+        glyphs[char] = np.asarray(image, dtype=bool)
+    return Atlas(lambda: draw(lambda d: d.ellipse((cx - RADIUS, cy - RADIUS, cx + RADIUS, cy + RADIUS), outline=1, width=1)),
+                 lambda turn: draw(lambda d: d.line((cx, cy) + arrow_tip(turn), fill=1, width=2)),
+                 glyphs, angles)
+
+
+def pygame_atlas(font, angles=ANGLES):
+    """Atlas drawn with the same pygame calls lcbovisual/boozevisual used to make every frame"""
+    import pygame
+
+    def draw(fn):
+        surface = pygame.Surface((WIDTH, HEIGHT))
+        fn(surface)
+        return pygame.surfarray.array2d(surface).T != 0
+
+    white = (255, 255, 255)
+    glyphs = {char: pygame.surfarray.array2d(font.render(char, False, white)).T != 0 for char in CHARS}
+    return Atlas(lambda: draw(lambda s: pygame.draw.circle(s, white, CENTER, RADIUS, 1)),
+                 lambda turn: draw(lambda s: pygame.draw.line(s, white, CENTER, arrow_tip(turn), 2)),
+                 glyphs, angles)
@@ -0,0 +1,185 @@
+"""Pickle-free store index: a directory of .npy arrays plus a small header.json.
+
+The front-ends open it with np.load(mmap_mode='r') so starting up doesn't unpickle
+anything or import scikit-learn. tree.py writes one (and the joblib file with --joblib), and
+`python storeindex.py treeall.joblib treeall.index` converts an existing joblib file.
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+from declination import load_declination
+from grid import load_grids
+from kdtree import ALL_CATEGORIES, KDTreeEngine, build_kdtree, group_by_query
+
+FORMAT = 'boozecompass-index'
+FORMAT_VERSION = 1
+HEADER_FILE = 'header.json'
+
+
+def write_index(path, arrays, **header):
+    """Writes each array to <path>/<name>.npy and describes them in header.json"""
+    os.makedirs(path, exist_ok=True)
+    for old in os.listdir(path):  # arrays a previous build had but this one doesn't
+        if old.endswith('.npy') and old[:-4] not in arrays:
+            os.remove(os.path.join(path, old))
+    described = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        np.save(os.path.join(path, name + '.npy'), array, allow_pickle=False)
+        described[name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    header = dict(header, format=FORMAT, version=FORMAT_VERSION, arrays=described)
+    # header goes last so a half written index never looks complete
+    with open(os.path.join(path, HEADER_FILE), 'w') as f:
+        json.dump(header, f, indent=1)
+    return header
+
+
+def read_index(path):
+    """Returns (header, arrays), every array memory mapped read-only"""
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        header = json.load(f)
+    if header.get('format') != FORMAT or header.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} store index")
+
+    arrays = {}
+    for name, desc in header['arrays'].items():
+        array = np.load(os.path.join(path, name + '.npy'), mmap_mode='r', allow_pickle=False)
+        if array.dtype.str != desc['dtype'] or list(array.shape) != desc['shape']:
+            raise ValueError(f"{path}/{name}.npy doesn't match its header")
+        arrays[name] = array
+    return header, arrays
+
+
+def write_store_index(path, store_locations_deg, names=None, category_mask=None, extra_arrays=None, **header):
+    """names are the store names, category_mask a bitmask per store, bit i = header['category_names'][i].
+    extra_arrays get saved as they are (the grids from grid.py)"""
+    store_locations_deg = np.asarray(store_locations_deg, dtype=np.float64).reshape(-1, 2)
+    arrays = {'stores_deg': store_locations_deg}
+    if names is not None:
+        arrays['names'] = np.asarray(names, dtype=str)
+    if category_mask is not None:
+        category_mask = arrays['category_mask'] = np.asarray(category_mask, dtype=np.uint32)
+    arrays.update(build_kdtree(store_locations_deg, category_mask))
+    arrays.update(extra_arrays or {})
+    return write_index(path, arrays, count=len(store_locations_deg), **header)
+
+
+class BruteForceEngine:
+    """Exact haversine nearest neighbours by checking every store, no sklearn needed.
+    query() takes and returns the same things as BallTree(metric='haversine').query(),
+    plus an optional categories bitmask"""
+
+    CHUNK = 1 << 20  # max query x store distances held in memory at once
+
+    def __init__(self, stores_deg, category_mask=None, category_names=None):
+        self.stores_rad = np.radians(stores_deg)
+        self.cos_lat = np.cos(self.stores_rad[:, 0])
+        self.category_mask = category_mask
+        self.category_names = category_names
+        self._filters = {}
+
+    def _filter(self, categories):
+        """(store indices, their radians and cos(lat)) for a category mask, cached"""
+        cached = self._filters.get(categories)
+        if cached is None:
+            if self.category_mask is None or categories == ALL_CATEGORIES:
+                keep = np.arange(len(self.stores_rad))
+            else:
+                keep = np.flatnonzero(self.category_mask & categories)
+            cached = (keep, self.stores_rad[keep], self.cos_lat[keep])
+            self._filters[categories] = cached
+        return cached
+
+    @staticmethod
+    def _a(points_rad, stores_rad, cos_lat):
+        """Haversine "a" value for every point x store, same formula and operation order as BallTree
+        so distances match exactly"""
+        sin_0 = np.sin(0.5 * (points_rad[:, :1] - stores_rad[:, 0]))
+        sin_1 = np.sin(0.5 * (points_rad[:, 1:] - stores_rad[:, 1]))
+        return sin_0 * sin_0 + np.cos(points_rad[:, :1]) * cos_lat * sin_1 * sin_1
+
+    def query(self, points_rad, k=1, categories=ALL_CATEGORIES):
+        points_rad = np.asarray(points_rad, dtype=np.float64).reshape(-1, 2)
+        keep, stores_rad, cos_lat = self._filter(int(categories))
+        n = len(stores_rad)
+        if k > n:
+            raise ValueError(f"k={k} but there are only {n} stores in those categories")
+        dist = np.empty((len(points_rad), k))
+        ind = np.empty((len(points_rad), k), dtype=np.intp)
+        rows = max(1, self.CHUNK // n)
+        for start in range(0, len(points_rad), rows):
+            chunk = points_rad[start:start + rows]
+            a = self._a(chunk, stores_rad, cos_lat)
+            if k < n:
+                part = np.argpartition(a, k - 1, axis=1)[:, :k]
+            else:
+                part = np.broadcast_to(np.arange(n), a.shape)
+            part_a = np.take_along_axis(a, part, axis=1)
+            order = np.argsort(part_a, axis=1, kind='stable')
+            ind[start:start + rows] = keep[np.take_along_axis(part, order, axis=1)]
+            dist[start:start + rows] = 2 * np.arcsin(np.sqrt(np.take_along_axis(part_a, order, axis=1)))
+        return dist, ind
+
+    def query_radius(self, points_rad, r, return_distance=True, sort_results=True, categories=ALL_CATEGORIES):
+        """Every store within r radians of each point, like BallTree.query_radius (always sorted by distance)"""
+        points_rad = np.asarray(points_rad, dtype=np.float64).reshape(-1, 2)
+        keep, stores_rad, cos_lat = self._filter(int(categories))
+        limit = np.sin(0.5 * r) ** 2
+        query_ind, store_ind, store_a = [], [], []
+        rows = max(1, self.CHUNK // max(1, len(stores_rad)))
+        for start in range(0, len(points_rad), rows):
+            chunk = points_rad[start:start + rows]
+            a = self._a(chunk, stores_rad, cos_lat)
+            hit_q, hit_s = np.nonzero(a <= limit)
+            query_ind.append(hit_q + start)
+            store_ind.append(keep[hit_s])
+            store_a.append(a[hit_q, hit_s])
+
+        ind, dist = group_by_query(len(points_rad), query_ind, store_ind, store_a)
+        return (ind, dist) if return_distance else ind
+
+
+def load_stores(path, engine='kdtree'):
+    """Drop-in for joblib.load('tree.joblib'): returns (tree, store_locations_deg).
+    engine is 'kdtree' (kdtree.py) or 'brute' (check every store)"""
+    header, arrays = read_index(path)
+    stores_deg = arrays['stores_deg']
+    category_mask = arrays.get('category_mask')
+    category_names = header.get('category_names')
+    if engine == 'brute':
+        tree = BruteForceEngine(stores_deg, category_mask, category_names)
+    elif engine != 'kdtree':
+        raise ValueError(f"unknown engine {engine!r}")
+    elif 'kd_index' in arrays:
+        tree = KDTreeEngine(stores_deg, arrays['kd_index'], arrays['kd_lo'], arrays['kd_hi'],
+                            category_mask, arrays.get('kd_mask'), category_names)
+    else:  # index from before the kd arrays were saved
+        tree = KDTreeEngine.from_stores(stores_deg, category_mask, category_names)
+    # O(1) lookups for the common case, StoreIndex/NearestCache try these before the tree
+    tree.grids = load_grids(header, arrays, stores_deg)
+    tree.declination = load_declination(header, arrays)  # WMM declination grid, None in older indexes
+    return tree, stores_deg
+
+
+def load_stores_or_joblib(path, joblib_path, engine='kdtree'):
+    """Uses the index if tree.py has made one, the old joblib file otherwise.
+    engine='balltree' always uses the sklearn BallTree from the joblib file"""
+    if engine != 'balltree':
+        try:
+            return load_stores(path, engine)
+        except FileNotFoundError:
+            pass
+    import joblib
+    return joblib.load(joblib_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python storeindex.py <tree.joblib> <output.index>")
+    import joblib
+    _, stores = joblib.load(sys.argv[1])
+    print(write_store_index(sys.argv[2], stores, source=os.path.basename(sys.argv[1])))